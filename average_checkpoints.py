@@ -0,0 +1,124 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Average the weights of several checkpoints into one checkpoint.
+
+By default the last --num_checkpoints checkpoints of train_dir are averaged:
+
+  python average_checkpoints.py --num_checkpoints 8
+
+writes train_dir/translate.ckpt-avg, which decodes like any other checkpoint:
+
+  python translate.py --decode --model translate.ckpt-avg < input
+
+Variables are read and averaged one at a time, so besides the result only one
+tensor per checkpoint is in memory. The scalars learning_rate and global_step
+are copied from the newest checkpoint and the Adam slots are left out, so the
+result is meant for decoding, not for resuming training.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+import checkpoint_utils
+
+tf.app.flags.DEFINE_string("train_dir", "../train_iwslt", "Training directory.")
+tf.app.flags.DEFINE_string("models", "",
+                           "comma-separated checkpoints in train_dir to average; "
+                           "default: the last --num_checkpoints ones")
+tf.app.flags.DEFINE_integer("num_checkpoints", 5, "number of latest checkpoints to average")
+tf.app.flags.DEFINE_string("output", "translate.ckpt-avg", "averaged checkpoint to write in train_dir")
+
+FLAGS = tf.app.flags.FLAGS
+
+
+def latest_checkpoints(train_dir, num_checkpoints):
+    """The paths of the last num_checkpoints checkpoints saved in train_dir.
+
+    The paths are returned as the saver stored them, which already includes
+    train_dir (see create_model in translate.py).
+    """
+    ckpt = tf.train.get_checkpoint_state(train_dir)
+    if not ckpt:
+        raise ValueError("No checkpoint state found in %s." % train_dir)
+    return list(ckpt.all_model_checkpoint_paths)[-num_checkpoints:]
+
+
+def is_averaged(value):
+    """Whether a variable is averaged rather than copied from the newest checkpoint.
+
+    The learning rate and the global step are the only scalar variables.
+    """
+    return value.ndim > 0 and np.issubdtype(value.dtype, np.floating)
+
+
+def average_checkpoints(session, checkpoint_paths, output_path):
+    """Average the inference variables of checkpoint_paths into output_path.
+
+    Args:
+      session: a tensorflow session with an empty default graph; the
+        variables of the averaged checkpoint are created in it.
+      checkpoint_paths: checkpoints to average, the newest last.
+      output_path: the checkpoint to write.
+    """
+    readers = [checkpoint_utils.checkpoint_reader(path) for path in checkpoint_paths]
+    names = sorted(name for name in readers[-1].get_variable_to_shape_map()
+                   if checkpoint_utils.is_inference_variable(name))
+
+    # The variables start at zero and receive their values one at a time, so
+    # that the graph does not hold a second copy of the weights as constants.
+    variables = {}
+    for name in names:
+        value = readers[-1].get_tensor(name)
+        variables[name] = tf.Variable(tf.zeros(value.shape, dtype=tf.as_dtype(value.dtype)),
+                                      name=name)
+    session.run(tf.initialize_all_variables())
+
+    for name in names:
+        value = readers[-1].get_tensor(name)
+        if is_averaged(value):
+            total = value.astype(np.float64)
+            for reader in readers[:-1]:
+                total += reader.get_tensor(name)
+            value = (total / len(readers)).astype(value.dtype)
+        placeholder = tf.placeholder(variables[name].dtype.base_dtype, value.shape)
+        session.run(variables[name].assign(placeholder), {placeholder: value})
+        print("%s %s" % (name, "averaged" if is_averaged(value) else "copied"))
+
+    saver = tf.train.Saver(variables)
+    saver.save(session, output_path, latest_filename="checkpoint_avg",
+               write_meta_graph=False)
+
+
+def main(_):
+    if FLAGS.models:
+        checkpoint_paths = [os.path.join(FLAGS.train_dir, model)
+                            for model in FLAGS.models.split(",")]
+    else:
+        checkpoint_paths = latest_checkpoints(FLAGS.train_dir, FLAGS.num_checkpoints)
+    output_path = os.path.join(FLAGS.train_dir, FLAGS.output)
+    print("Averaging %s" % ", ".join(os.path.basename(path) for path in checkpoint_paths))
+    with tf.Session() as sess:
+        average_checkpoints(sess, checkpoint_paths, output_path)
+    print("Wrote %s" % output_path)
+
+
+if __name__ == "__main__":
+    tf.app.run()
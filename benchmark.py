@@ -0,0 +1,205 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Benchmark the training and decoding hot paths on synthetic data.
+
+Nothing is downloaded or read from data_dir: a parallel corpus of random
+token ids in three streams (source, draft, target) and random constant
+embeddings are generated in --bench_dir, and the model is built with the
+translate.py flags (--hidden_units, --batch_size, ...). Timed are
+
+  read_data                   reading the corpus into buckets,
+  get_batch/bucket<b>         building a training batch,
+  train_step/bucket<b>        a training step,
+  decode/beam<k>/bucket<b>    decoding one sentence pair of the bucket's
+                              lengths with beam size k,
+
+each as the median over --bench_repeats runs after a warm-up run. Timings are
+saved with --save_baseline and compared with --baseline, which reports the
+ratio of every timing to its baseline and exits with status 1 when one is
+slower by more than --bench_tolerance:
+
+  python benchmark.py --hidden_units 128 --save_baseline bench.json
+  python benchmark.py --hidden_units 128 --baseline bench.json
+
+Runs on CPU; baselines are only comparable on the same machine and flags.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from six.moves import xrange  # pylint: disable=redefined-builtin
+import tensorflow as tf
+
+import bucketing
+import data_utils
+import seq2seq_model
+import translate
+
+tf.app.flags.DEFINE_string("bench_dir", "/tmp/translate_benchmark",
+                           "Directory for the synthetic corpus.")
+tf.app.flags.DEFINE_integer("bench_sentences", 20000,
+                            "Sentence triples in the synthetic corpus.")
+tf.app.flags.DEFINE_integer("bench_vocab_size", 10000,
+                            "Size of every synthetic vocabulary.")
+tf.app.flags.DEFINE_integer("bench_repeats", 10, "Timed runs of each benchmark.")
+tf.app.flags.DEFINE_string("bench_beam_sizes", "1,5,10",
+                           "Comma-separated beam sizes to decode with.")
+tf.app.flags.DEFINE_string("baseline", "", "Baseline timings (JSON) to compare with.")
+tf.app.flags.DEFINE_string("save_baseline", "", "Write the timings (JSON) to this file.")
+tf.app.flags.DEFINE_float("bench_tolerance", 0.1,
+                          "Slowdown over the baseline reported as a regression.")
+
+FLAGS = tf.app.flags.FLAGS
+
+_buckets = translate._buckets
+
+
+def make_corpus(directory, num_sentences, vocab_size, seed=0):
+    """Write a random token-id corpus of num_sentences triples.
+
+    Every triple is drawn for a random bucket, with lengths that fit that
+    bucket and not the previous one, so all buckets are populated.
+
+    Returns:
+      The paths of the source, draft and target token-id files.
+    """
+    rng = np.random.RandomState(seed)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    paths = [os.path.join(directory, "bench.ids.%s" % name)
+             for name in ("en_1", "en_2", "fr")]
+    files = [open(path, "w") for path in paths]
+    for _ in xrange(num_sentences):
+        bucket_id = rng.randint(len(_buckets))
+        for k, f in enumerate(files):
+            # Lengths exclude the EOS appended by read_data.
+            high = _buckets[bucket_id][k] - 1
+            low = min(_buckets[bucket_id - 1][k] - 1, high - 1) if bucket_id else 1
+            length = rng.randint(low, high)
+            ids = rng.randint(len(data_utils._START_VOCAB), vocab_size, size=length)
+            f.write(" ".join(str(i) for i in ids) + "\n")
+    for f in files:
+        f.close()
+    return paths
+
+
+def create_model(session, forward_only, beam_size, vocab_size, seed=0):
+    """A model of the translate.py flags with random constant embeddings."""
+    rng = np.random.RandomState(seed)
+    constant_emb_en = rng.normal(0, 0.01, (vocab_size, FLAGS.hidden_edim)).astype(np.float32)
+    constant_emb_fr = rng.normal(0, 0.01, (vocab_size, FLAGS.hidden_edim)).astype(np.float32)
+    model = seq2seq_model.Seq2SeqModel(
+            vocab_size, vocab_size, vocab_size, _buckets,
+            FLAGS.hidden_edim, FLAGS.hidden_units,
+            FLAGS.num_layers, FLAGS.max_gradient_norm, FLAGS.batch_size,
+            FLAGS.learning_rate, FLAGS.learning_rate_decay_factor,
+            beam_size,
+            constant_emb_en=constant_emb_en,
+            constant_emb_fr=constant_emb_fr,
+            forward_only=forward_only,
+            stack_directions=FLAGS.stack_directions)
+    session.run(tf.initialize_all_variables())
+    session.run(tf.initialize_local_variables())
+    return model
+
+
+def time_median(function, repeats):
+    """The median time in seconds of repeats calls of function, after a warm-up."""
+    function()
+    times = []
+    for _ in xrange(repeats):
+        start_time = time.time()
+        function()
+        times.append(time.time() - start_time)
+    return float(np.median(times))
+
+
+def run_benchmarks():
+    """Run every benchmark; returns an ordered dict from name to seconds."""
+    results = collections.OrderedDict()
+
+    def record(name, function):
+        results[name] = time_median(function, FLAGS.bench_repeats)
+        print("%-28s %10.2f ms" % (name, 1000.0 * results[name]))
+        sys.stdout.flush()
+
+    paths = make_corpus(FLAGS.bench_dir, FLAGS.bench_sentences, FLAGS.bench_vocab_size)
+    data_set = translate.read_data(*paths)
+    record("read_data", lambda: translate.read_data(*paths))
+
+    with tf.Graph().as_default(), tf.Session(config=translate.session_config()) as sess:
+        model = create_model(sess, False, FLAGS.beam_size, FLAGS.bench_vocab_size)
+        for bucket_id in xrange(len(_buckets)):
+            record("get_batch/bucket%d" % bucket_id,
+                   lambda: model.get_batch(data_set, bucket_id))
+            batch = model.get_batch(data_set, bucket_id)
+            record("train_step/bucket%d" % bucket_id,
+                   lambda: model.step(sess, *(list(batch) + [bucket_id, False])))
+
+    for beam_size in [int(k) for k in FLAGS.bench_beam_sizes.split(",")]:
+        with tf.Graph().as_default(), tf.Session(config=translate.session_config()) as sess:
+            model = create_model(sess, True, beam_size, FLAGS.bench_vocab_size)
+            model.batch_size = 1  # As in translate.decode, one sentence at a time.
+            for bucket_id in xrange(len(_buckets)):
+                source_1, source_2, _ = data_set[bucket_id][0]
+                sentence = {bucket_id: [(source_1, source_2, [])]}
+
+                def decode_sentence():
+                    batch = model.get_batch(sentence, bucket_id)
+                    model.step(sess, *(list(batch) + [bucket_id, True]))
+                record("decode/beam%d/bucket%d" % (beam_size, bucket_id), decode_sentence)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the ratio of each timing to its baseline; returns the regressions."""
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        ratio = seconds / baseline[name]
+        regressed = ratio > 1.0 + tolerance
+        print("%-28s %6.2fx%s" % (name, ratio, "  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main(_):
+    if FLAGS.buckets:
+        _buckets[:] = bucketing.parse_buckets(FLAGS.buckets)
+    results = run_benchmarks()
+    if FLAGS.save_baseline:
+        with open(FLAGS.save_baseline, "w") as f:
+            json.dump(results, f, indent=1)
+        print("Wrote %s" % FLAGS.save_baseline)
+    if FLAGS.baseline:
+        with open(FLAGS.baseline) as f:
+            baseline = json.load(f)
+        print("Compared with %s:" % FLAGS.baseline)
+        if compare(results, baseline, FLAGS.bench_tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    tf.app.run()
@@ -0,0 +1,172 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Choose bucket sizes that minimize padding on a training corpus.
+
+Reads the token-id files of the source, draft and target streams, builds the
+histogram of their joint lengths and searches for num_buckets bucket triples
+(source size, draft size, target size) with the fewest padded positions when
+every example goes to the first bucket it fits, as in translate.read_data:
+
+  python bucketing.py --num_buckets 4 train.ids15000.en_1 train.ids10000.en_2 \\
+      train.ids10000.fr
+
+The result is printed as a --buckets value for translate.py. Sizes are taken
+as read_data sees them: lengths cut to 50 tokens, plus EOS, must be smaller
+than the bucket size. The search is a coordinate descent started from
+per-stream quantiles, so the buckets are a local optimum; the largest bucket
+always fits the longest example.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+
+import numpy as np
+
+# Lengths longer than this are cut by translate.read_data.
+MAX_LENGTH = 50
+
+DEFAULT_BUCKETS = [(5, 10, 10), (10, 15, 15), (20, 25, 25), (45, 50, 50)]
+
+
+def parse_buckets(value):
+    """Buckets from a value such as "5,10,10/10,15,15", sorted by size."""
+    buckets = [tuple(int(size) for size in bucket.split(","))
+               for bucket in value.split("/") if bucket]
+    if not buckets or any(len(bucket) != 3 for bucket in buckets):
+        raise ValueError("Buckets must be size triples such as 5,10,10/10,15,15: %r" % value)
+    return sorted(buckets)
+
+
+def format_buckets(buckets):
+    """The inverse of parse_buckets."""
+    return "/".join(",".join(str(size) for size in bucket) for bucket in buckets)
+
+
+def length_histogram(source_path_1, source_path_2, target_path, max_size=None):
+    """Count the examples of the id files by their sizes needed in a bucket.
+
+    Returns:
+      A Counter from (source size, draft size, target size), the smallest
+      bucket sizes that fit the example (length plus EOS plus one), to the
+      number of examples.
+    """
+    histogram = collections.Counter()
+    with open(source_path_1) as source_file_1, open(source_path_2) as source_file_2, \
+            open(target_path) as target_file:
+        for counter, lines in enumerate(zip(source_file_1, source_file_2, target_file)):
+            if max_size and counter >= max_size:
+                break
+            histogram[tuple(min(len(line.split()), MAX_LENGTH) + 2 for line in lines)] += 1
+    return histogram
+
+
+def _as_arrays(histogram):
+    needs = np.array(list(histogram.keys()), dtype=np.int64).reshape(-1, 3)
+    counts = np.array(list(histogram.values()), dtype=np.int64)
+    return needs, counts
+
+
+def padded_positions(histogram, buckets):
+    """Positions fed and tokens of the histogram's examples in buckets.
+
+    Examples that fit no bucket are left out, as read_data does.
+
+    Returns:
+      The triple (positions, tokens, examples), where tokens count the words
+      and EOS of the three streams and examples those that fit a bucket.
+    """
+    needs, counts = _as_arrays(histogram)
+    buckets = np.array(buckets, dtype=np.int64)
+    fits = (needs[:, None, :] <= buckets[None, :, :]).all(axis=2)
+    fitted = fits.any(axis=1)
+    first = fits.argmax(axis=1)
+    positions = (counts * buckets[first].sum(axis=1))[fitted].sum()
+    tokens = (counts * (needs - 1).sum(axis=1))[fitted].sum()
+    return int(positions), int(tokens), int(counts[fitted].sum())
+
+
+def choose_buckets(histogram, num_buckets):
+    """Bucket triples for histogram with few padded positions.
+
+    Args:
+      histogram: as returned by length_histogram.
+      num_buckets: number of buckets.
+
+    Returns:
+      A sorted list of num_buckets (source, draft, target) triples; each size
+      is non-decreasing from bucket to bucket.
+    """
+    needs, counts = _as_arrays(histogram)
+    buckets = np.zeros((num_buckets, 3), dtype=np.int64)
+    for k in range(3):
+        order = np.argsort(needs[:, k], kind="mergesort")
+        cumulative = np.cumsum(counts[order]) / counts.sum()
+        for i in range(num_buckets):
+            quantile = (i + 1) / num_buckets
+            buckets[i, k] = needs[order][min(np.searchsorted(cumulative, quantile),
+                                             len(order) - 1), k]
+    buckets[-1] = needs.max(axis=0)
+    candidates = [np.unique(needs[:, k]) for k in range(3)]
+
+    best = padded_positions(histogram, buckets)[0]
+    improved = True
+    while improved:
+        improved = False
+        for i in range(num_buckets - 1):
+            for k in range(3):
+                low = buckets[i - 1, k] if i else 0
+                high = buckets[i + 1, k]
+                for size in candidates[k][(candidates[k] >= low) & (candidates[k] <= high)]:
+                    if size == buckets[i, k]:
+                        continue
+                    previous, buckets[i, k] = buckets[i, k], size
+                    positions = padded_positions(histogram, buckets)[0]
+                    if positions < best:
+                        best, improved = positions, True
+                    else:
+                        buckets[i, k] = previous
+    return [tuple(int(size) for size in bucket) for bucket in buckets]
+
+
+def _report(name, histogram, buckets):
+    positions, tokens, examples = padded_positions(histogram, buckets)
+    print("%-8s %-40s padding %.1f%% of %d positions, %d of %d examples fit"
+          % (name, format_buckets(buckets), 100.0 * (1 - tokens / max(positions, 1)),
+             positions, examples, sum(histogram.values())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("source_1", help="token ids of the source")
+    parser.add_argument("source_2", help="token ids of the draft")
+    parser.add_argument("target", help="token ids of the target")
+    parser.add_argument("--num_buckets", type=int, default=4, help="number of buckets")
+    parser.add_argument("--max_size", type=int, default=0,
+                        help="read at most this many examples (0: all)")
+    args = parser.parse_args()
+
+    histogram = length_histogram(args.source_1, args.source_2, args.target, args.max_size)
+    buckets = choose_buckets(histogram, args.num_buckets)
+    _report("default", histogram, DEFAULT_BUCKETS)
+    _report("chosen", histogram, buckets)
+    print("--buckets=%s" % format_buckets(buckets))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Saving checkpoints without stalling the training loop, and pruning them."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import json
+import os
+import re
+import sys
+import threading
+
+import tensorflow as tf
+
+import checkpoint_utils
+
+# Dev metric of each evaluated checkpoint, in train_dir (see record_dev_metric).
+DEV_METRICS_FILE = "dev_metrics.json"
+
+_STEP_RE = re.compile(r"-(\d+)$")
+_WEIGHTS_COPY_SUFFIX = ".npz"
+
+
+class AsyncSaver(object):
+    """Writes checkpoints from a background thread.
+
+    save() copies the variables into shadow variables, which takes one
+    in-memory op, and returns; a background thread then writes the shadow
+    copies to disk while training goes on. The checkpoints are the same as
+    those of a tf.train.Saver over the original variables, so they restore
+    with model.saver. A save waits for the previous one to finish before
+    overwriting the shadows.
+    """
+
+    def __init__(self, var_list, **saver_kwargs):
+        """Create the shadow variables and their saver.
+
+        Args:
+          var_list: the variables to checkpoint, e.g. tf.all_variables().
+          **saver_kwargs: passed on to tf.train.Saver (max_to_keep, ...).
+        """
+        shadows = {}
+        with tf.name_scope("snapshot"):
+            for v in var_list:
+                shadows[v.op.name] = tf.Variable(
+                        tf.zeros(v.get_shape(), dtype=v.dtype.base_dtype),
+                        trainable=False, collections=[], name=v.op.name)
+        # Kept out of every collection so that model savers never see them.
+        self._init_op = tf.initialize_variables(list(shadows.values()))
+        self._snapshot_op = tf.group(*[shadows[v.op.name].assign(v) for v in var_list])
+        self.saver = tf.train.Saver(shadows, **saver_kwargs)
+        self._thread = None
+        self._initialized = False
+
+    def save(self, session, save_path, global_step=None):
+        """Snapshot the variables and write them to save_path in the background.
+
+        Args:
+          session: the training session.
+          save_path: as for tf.train.Saver.save.
+          global_step: int, or a tensor evaluated at snapshot time, appended
+            to save_path as for tf.train.Saver.save.
+
+        Returns:
+          The path of the checkpoint being written.
+        """
+        self.wait()
+        if not self._initialized:
+            session.run(self._init_op)
+            self._initialized = True
+        if isinstance(global_step, (tf.Tensor, tf.Variable)):
+            global_step = int(session.run(global_step))
+        session.run(self._snapshot_op)
+        self._thread = threading.Thread(target=self._write,
+                                        args=(session, save_path, global_step))
+        self._thread.daemon = True
+        self._thread.start()
+        return save_path if global_step is None else "%s-%d" % (save_path, global_step)
+
+    def _write(self, session, save_path, global_step):
+        try:
+            self.saver.save(session, save_path, global_step=global_step)
+        except Exception as e:  # pylint: disable=broad-except
+            sys.stderr.write("Saving checkpoint %s-%s failed: %s\n" % (save_path, global_step, e))
+
+    def wait(self):
+        """Block until the checkpoint being written, if any, is on disk."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def set_last_checkpoints(self, last_checkpoints):
+        """As tf.train.Saver.set_last_checkpoints, once pending writes are done."""
+        self.wait()
+        self.saver.set_last_checkpoints(last_checkpoints)
+
+
+def load_dev_metrics(train_dir):
+    """The dict from checkpoint name to dev metric recorded in train_dir."""
+    path = os.path.join(train_dir, DEV_METRICS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def record_dev_metric(train_dir, checkpoint_path, metric):
+    """Record the dev metric (lower is better) of a checkpoint of train_dir."""
+    metrics = load_dev_metrics(train_dir)
+    metrics[os.path.basename(checkpoint_path)] = metric
+    path = os.path.join(train_dir, DEV_METRICS_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(metrics, f, indent=1, sort_keys=True)
+    os.rename(path + ".tmp", path)
+
+
+def checkpoint_step(checkpoint_path):
+    """The global step in the name of a checkpoint, or None."""
+    match = _STEP_RE.search(checkpoint_path)
+    return int(match.group(1)) if match else None
+
+
+class RetentionPolicy(object):
+    """Decides which checkpoints of a training run to keep and deletes the rest.
+
+    A checkpoint is kept if it is among the keep_last newest ones (the newest
+    one always is), among the keep_best ones by dev metric (see
+    record_dev_metric), or if its global step is a multiple of
+    keep_every_n_steps. Checkpoints newer than the newest evaluated one are
+    kept until they have been evaluated. A value of 0 disables a rule.
+
+    Weights copies (see weights_copies) of deleted checkpoints are kept for
+    the keep_weights_copies newest of them and deleted for the others.
+    """
+
+    def __init__(self, train_dir, keep_best=0, keep_last=0, keep_every_n_steps=0,
+                 weights_copies=False, keep_weights_copies=0):
+        """Create the policy.
+
+        Args:
+          train_dir: the directory the checkpoints are saved in.
+          keep_best: number of checkpoints with the best dev metric to keep.
+          keep_last: number of newest checkpoints to keep.
+          keep_every_n_steps: keep checkpoints whose step is a multiple of this.
+          weights_copies: if set, write a weights file (checkpoint_utils) next
+            to each checkpoint, which can survive the deletion of the checkpoint.
+          keep_weights_copies: number of weights copies of deleted checkpoints
+            to keep, the newest ones; 0 deletes a copy with its checkpoint.
+        """
+        self.train_dir = train_dir
+        self.keep_best = keep_best
+        self.keep_last = keep_last
+        self.keep_every_n_steps = keep_every_n_steps
+        self.weights_copies = weights_copies
+        self.keep_weights_copies = keep_weights_copies
+
+    def to_keep(self, checkpoint_paths, metrics):
+        """The subset of checkpoint_paths (oldest first) to keep, in order."""
+        keep = set(checkpoint_paths[-max(self.keep_last, 1):])
+        evaluated = [path for path in checkpoint_paths
+                     if os.path.basename(path) in metrics]
+        if self.keep_best:
+            best = sorted(evaluated, key=lambda path: metrics[os.path.basename(path)])
+            keep.update(best[:self.keep_best])
+        if evaluated:
+            keep.update(checkpoint_paths[checkpoint_paths.index(evaluated[-1]) + 1:])
+        else:
+            keep.update(checkpoint_paths)
+        if self.keep_every_n_steps:
+            keep.update(path for path in checkpoint_paths
+                        if (checkpoint_step(path) or 0) % self.keep_every_n_steps == 0)
+        return [path for path in checkpoint_paths if path in keep]
+
+    def apply(self, saver=None):
+        """Prune the checkpoints listed in the checkpoint state of train_dir.
+
+        Args:
+          saver: the tf.train.Saver (or AsyncSaver) that writes the
+            checkpoints; it is told which ones remain, so that its next save
+            does not list deleted checkpoints again.
+
+        Returns:
+          The paths of the deleted checkpoints.
+        """
+        # The paths of the checkpoint state already include train_dir.
+        if saver is not None and hasattr(saver, "wait"):
+            saver.wait()
+        ckpt = tf.train.get_checkpoint_state(self.train_dir)
+        if not ckpt:
+            return []
+        checkpoint_paths = list(ckpt.all_model_checkpoint_paths)
+        if self.weights_copies:
+            for path in checkpoint_paths:
+                if not os.path.exists(path + _WEIGHTS_COPY_SUFFIX):
+                    checkpoint_utils.save_weights(path + _WEIGHTS_COPY_SUFFIX,
+                                                  checkpoint_utils.read_checkpoint(path))
+        kept = self.to_keep(checkpoint_paths, load_dev_metrics(self.train_dir))
+        deleted = [path for path in checkpoint_paths if path not in kept]
+        for path in deleted:
+            # Other .npz files, such as quantize.py exports, are left alone.
+            for filename in [path] + glob.glob(path + ".*"):
+                if not filename.endswith(".npz") and os.path.exists(filename):
+                    os.remove(filename)
+        if self.weights_copies:
+            self._prune_weights_copies(checkpoint_paths, kept)
+        if deleted:
+            tf.train.update_checkpoint_state(self.train_dir, ckpt.model_checkpoint_path,
+                                             all_model_checkpoint_paths=kept)
+            if saver is not None:
+                saver.set_last_checkpoints(kept)
+        return deleted
+
+    def _prune_weights_copies(self, checkpoint_paths, kept):
+        """Delete the weights copies of deleted checkpoints beyond the newest ones."""
+        copies = set()
+        for path in checkpoint_paths:
+            prefix = _STEP_RE.sub("", path)
+            copies.update(filename for filename in glob.glob(prefix + "-*" + _WEIGHTS_COPY_SUFFIX)
+                          if checkpoint_step(filename[:-len(_WEIGHTS_COPY_SUFFIX)]) is not None)
+        orphans = sorted((filename for filename in copies
+                          if filename[:-len(_WEIGHTS_COPY_SUFFIX)] not in kept),
+                         key=lambda filename: checkpoint_step(filename[:-len(_WEIGHTS_COPY_SUFFIX)]))
+        for filename in orphans[:max(len(orphans) - self.keep_weights_copies, 0)]:
+            os.remove(filename)
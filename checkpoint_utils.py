@@ -0,0 +1,107 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Reading model weights from checkpoints and storing them as numpy archives.
+
+A weights file is a `.npz` archive with one array per variable, keyed by the
+variable name (e.g. "proj_w"). Variables stored in int8 have their float32
+per-channel scales next to them under `name + SCALE_SUFFIX`. Only reading a
+TensorFlow checkpoint needs TensorFlow; weights files are plain numpy.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+SCALE_SUFFIX = ":scale"
+
+# Optimizer state that is never needed to run the model.
+_OPTIMIZER_SUFFIXES = ("/Adam", "/Adam_1")
+_OPTIMIZER_NAMES = ("beta1_power", "beta2_power")
+
+
+def is_inference_variable(name):
+    """Whether variable `name` is needed for inference (not an Adam slot)."""
+    return not (name.endswith(_OPTIMIZER_SUFFIXES) or name in _OPTIMIZER_NAMES)
+
+
+def checkpoint_reader(checkpoint_path):
+    """A reader that loads the variables of a checkpoint one at a time.
+
+    The reader's get_tensor(name) returns the numpy value of a variable and
+    get_variable_to_shape_map() lists the variables.
+    """
+    from tensorflow.python import pywrap_tensorflow
+    return pywrap_tensorflow.NewCheckpointReader(checkpoint_path)
+
+
+def read_checkpoint(checkpoint_path, filter_fn=is_inference_variable):
+    """Read the variables of a checkpoint into numpy arrays.
+
+    Args:
+      checkpoint_path: path of the checkpoint, e.g. "train/translate.ckpt-250".
+      filter_fn: predicate on variable names; by default optimizer slots are
+        skipped.
+
+    Returns:
+      A dict from variable name to numpy array.
+    """
+    reader = checkpoint_reader(checkpoint_path)
+    return dict((name, reader.get_tensor(name))
+                for name in reader.get_variable_to_shape_map()
+                if filter_fn is None or filter_fn(name))
+
+
+def save_weights(path, weights, scales=None):
+    """Write weights (and the scales of the quantized ones) to a .npz file.
+
+    Args:
+      path: output path; numpy appends ".npz" if it is missing.
+      weights: a dict from variable name to numpy array.
+      scales: optional dict from variable name to the per-channel scales of
+        the int8 arrays in weights.
+    """
+    arrays = dict(weights)
+    for name, scale in (scales or {}).items():
+        arrays[name + SCALE_SUFFIX] = scale
+    np.savez(path, **arrays)
+
+
+def load_weights(path, dequantize=True):
+    """Load a weights file written by save_weights.
+
+    Args:
+      path: path of the .npz file.
+      dequantize: if True, int8 arrays are multiplied back by their scales and
+        a single float32 dict is returned.
+
+    Returns:
+      A dict from variable name to numpy array if dequantize is set, otherwise
+      a pair (weights, scales) of such dicts, scales holding the per-channel
+      scales of the int8 entries of weights.
+    """
+    weights, scales = {}, {}
+    with np.load(path) as archive:
+        for key in archive.files:
+            if key.endswith(SCALE_SUFFIX):
+                scales[key[:-len(SCALE_SUFFIX)]] = archive[key]
+            else:
+                weights[key] = archive[key]
+    if not dequantize:
+        return weights, scales
+    for name, scale in scales.items():
+        weights[name] = weights[name].astype(np.float32) * scale
+    return weights
@@ -0,0 +1,133 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Epoch-by-epoch iteration over the buckets of a training set."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import sys
+
+import numpy as np
+
+
+class EpochIterator(object):
+    """Yields non-overlapping batches of a bucketed data set, epoch by epoch.
+
+    An epoch shuffles the examples of each bucket, cuts them into batches,
+    and visits the batches of all buckets in a shuffled order, so that
+    buckets come up in proportion to their size as with sampling. The last
+    batch of a bucket is filled up with examples from the start of its
+    shuffle, so every example is visited, also in buckets smaller than one
+    batch. The shuffles depend only on the seed and the epoch, so the
+    position (epoch, batch) is the whole state; it is saved next to each
+    checkpoint and restored to resume training exactly where it stopped.
+    """
+
+    def __init__(self, bucket_sizes, batch_size, seed=0):
+        """Create the iterator at the start of the first epoch.
+
+        Args:
+          bucket_sizes: number of examples in each bucket of the data set.
+          batch_size: number of examples per batch.
+          seed: seed of the shuffles.
+
+        Raises:
+          ValueError: if all buckets are empty.
+        """
+        self.bucket_sizes = [int(size) for size in bucket_sizes]
+        self.batch_size = batch_size
+        self.seed = seed
+        if not any(self.bucket_sizes):
+            raise ValueError("No examples to iterate over.")
+        self.epoch = 0
+        self.position = 0
+        self._start_epoch()
+
+    def _start_epoch(self):
+        rng = np.random.RandomState([self.seed, self.epoch])
+        self._permutations = [rng.permutation(size) for size in self.bucket_sizes]
+        schedule = [(bucket_id, batch)
+                    for bucket_id, size in enumerate(self.bucket_sizes)
+                    for batch in range((size + self.batch_size - 1) // self.batch_size)]
+        self._schedule = [schedule[i] for i in rng.permutation(len(schedule))]
+
+    @property
+    def batches_per_epoch(self):
+        return len(self._schedule)
+
+    def next_batch(self):
+        """The next batch, as the pair (bucket_id, indices into the bucket)."""
+        if self.position == len(self._schedule):
+            self.epoch += 1
+            self.position = 0
+            self._start_epoch()
+        bucket_id, batch = self._schedule[self.position]
+        self.position += 1
+        indices = self._permutations[bucket_id].take(
+                range(batch * self.batch_size, (batch + 1) * self.batch_size), mode="wrap")
+        return bucket_id, indices
+
+    def state(self):
+        """The position of the iterator, as a JSON-serializable dict."""
+        return {"seed": self.seed, "epoch": self.epoch, "position": self.position,
+                "batch_size": self.batch_size, "bucket_sizes": self.bucket_sizes}
+
+    def set_state(self, state):
+        """Move to a position returned by state().
+
+        Raises:
+          ValueError: if the state is of another data set or batch size.
+        """
+        if state["bucket_sizes"] != self.bucket_sizes or state["batch_size"] != self.batch_size:
+            raise ValueError("Iterator state of buckets %s with batch size %d does not "
+                             "match buckets %s with batch size %d."
+                             % (state["bucket_sizes"], state["batch_size"],
+                                self.bucket_sizes, self.batch_size))
+        self.seed = state["seed"]
+        self.epoch = state["epoch"]
+        self.position = state["position"]
+        self._start_epoch()
+
+    def save(self, path):
+        """Write the state to path."""
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.state(), f)
+        os.rename(path + ".tmp", path)
+
+    def restore(self, path):
+        """Read the state from path; returns whether it was resumed.
+
+        A state of other buckets or another batch size, e.g. after --buckets,
+        --batch_size or the number of replicas changed, cannot be resumed: a
+        warning is printed and the iterator starts the epoch after the saved
+        one instead.
+        """
+        if not os.path.exists(path):
+            return False
+        with open(path) as f:
+            state = json.load(f)
+        try:
+            self.set_state(state)
+        except ValueError as e:
+            sys.stderr.write("Warning: %s Starting epoch %d from its first batch.\n"
+                             % (e, state["epoch"] + 1))
+            self.epoch = state["epoch"] + 1
+            self.position = 0
+            self._start_epoch()
+            return False
+        return True
@@ -13,20 +13,28 @@
 # limitations under the License.
 # ==============================================================================
 
-"""Utilities for downloading data from WMT, tokenizing, vocabularies."""
+"""Utilities for downloading data from WMT, tokenizing, vocabularies.
+
+This module does not import TensorFlow, so data preparation runs without
+paying for it:
+
+  python data_utils.py --data_dir ../data_iwslt
+"""
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import argparse
 import gzip
+import mmap
 import os
 import re
+import struct
 import tarfile
+import zlib
 
 from six.moves import urllib
 
-from tensorflow.python.platform import gfile
-
 # Special vocabulary symbols - we always put them at the start.
 _PAD = b"_PAD"
 _GO = b"_GO"
@@ -45,6 +53,14 @@ NULL_ID = 4
 _WORD_SPLIT = re.compile(b"([.,!?\"':;)(])")
 _DIGIT_RE = re.compile(br"\d")
 
+# Binary vocabularies are written next to the text ones, with this suffix.
+BINARY_VOCABULARY_SUFFIX = ".bin"
+_BINARY_MAGIC = b"VOC2"
+# Magic, number of tokens, table size, and the size and modification time of
+# the text file the binary vocabulary was made from.
+_BINARY_HEADER = struct.Struct("<4sIIQd")
+_UINT32 = struct.Struct("<I")
+
 # URLs for WMT data.
 _WMT_ENFR_TRAIN_URL = "http://www.statmt.org/wmt10/training-giga-fren.tar"
 _WMT_ENFR_DEV_URL = "http://www.statmt.org/wmt15/dev-v2.tgz"
@@ -76,7 +92,7 @@ def gunzip_file(gz_path, new_path):
 def get_wmt_enfr_train_set(directory):
     """Download the WMT en-fr training corpus to directory unless it's there."""
     train_path = os.path.join(directory, "giga-fren.release2.fixed")
-    if not (gfile.Exists(train_path + ".fr") and gfile.Exists(train_path + ".en")):
+    if not (os.path.exists(train_path + ".fr") and os.path.exists(train_path + ".en")):
         corpus_file = maybe_download(directory, "training-giga-fren.tar",
                                      _WMT_ENFR_TRAIN_URL)
         print("Extracting tar file %s" % corpus_file)
@@ -91,7 +107,7 @@ def get_wmt_enfr_dev_set(directory):
     """Download the WMT en-fr training corpus to directory unless it's there."""
     dev_name = "newstest2013"
     dev_path = os.path.join(directory, dev_name)
-    if not (gfile.Exists(dev_path + ".fr") and gfile.Exists(dev_path + ".en")):
+    if not (os.path.exists(dev_path + ".fr") and os.path.exists(dev_path + ".en")):
         dev_file = maybe_download(directory, "dev-v2.tgz", _WMT_ENFR_DEV_URL)
         print("Extracting tgz file %s" % dev_file)
         with tarfile.open(dev_file, "r:gz") as dev_tar:
@@ -123,6 +139,8 @@ def create_vocabulary(vocabulary_path, data_path, max_vocabulary_size,
     Vocabulary contains the most-frequent tokens up to max_vocabulary_size.
     We write it to vocabulary_path in a one-token-per-line format, so that later
     token in the first line gets id=0, second line gets id=1, and so on.
+    The binary form read by initialize_vocabulary is written next to it,
+    also for an existing vocabulary file that lacks an up-to-date one.
 
     Args:
       vocabulary_path: path where the vocabulary will be created.
@@ -132,10 +150,10 @@ def create_vocabulary(vocabulary_path, data_path, max_vocabulary_size,
         if None, basic_tokenizer will be used.
       normalize_digits: Boolean; if true, all digits are replaced by 0s.
     """
-    if not gfile.Exists(vocabulary_path):
+    if not os.path.exists(vocabulary_path):
         print("Creating vocabulary %s from data %s" % (vocabulary_path, data_path))
         vocab = {}
-        with gfile.GFile(data_path, mode="rb") as f:
+        with open(data_path, mode="rb") as f:
             counter = 0
             for line in f:
                 counter += 1
@@ -151,9 +169,137 @@ def create_vocabulary(vocabulary_path, data_path, max_vocabulary_size,
             vocab_list = _START_VOCAB + sorted(vocab, key=vocab.get, reverse=True)
             if len(vocab_list) > max_vocabulary_size:
                 vocab_list = vocab_list[:max_vocabulary_size]
-            with gfile.GFile(vocabulary_path, mode="wb") as vocab_file:
+            with open(vocabulary_path, mode="wb") as vocab_file:
                 for w in vocab_list:
                     vocab_file.write(w + b"\n")
+    binary_path = vocabulary_path + BINARY_VOCABULARY_SUFFIX
+    if _binary_vocabulary(vocabulary_path) is None:
+        print("Creating binary vocabulary %s" % binary_path)
+        stat = os.stat(vocabulary_path)
+        with open(vocabulary_path, mode="rb") as f:
+            write_binary_vocabulary([line.strip() for line in f], binary_path,
+                                    stat.st_size, stat.st_mtime)
+
+
+def _binary_vocabulary(vocabulary_path):
+    """The binary form of a vocabulary file, or None if it is missing or stale.
+
+    The binary form is stale unless it records the current size and
+    modification time of the text file; any change to them, also to an older
+    time (cp -p, rsync -t, tar), makes it stale.
+    """
+    binary_path = vocabulary_path + BINARY_VOCABULARY_SUFFIX
+    if not os.path.exists(binary_path):
+        return None
+    try:
+        vocab = BinaryVocabulary(binary_path)
+    except (ValueError, struct.error):
+        return None  # Of another format version, or truncated.
+    stat = os.stat(vocabulary_path)
+    if (vocab.source_size, vocab.source_mtime) != (stat.st_size, stat.st_mtime):
+        return None
+    return vocab
+
+
+def write_binary_vocabulary(rev_vocab, path, source_size=0, source_mtime=0.0):
+    """Write a vocabulary, given as its list of tokens, for BinaryVocabulary.
+
+    The file holds, after a 28-byte header (magic, number of tokens n, table
+    size, and source_size and source_mtime, those of the text file it is
+    made from), n + 1 uint32 offsets of the tokens in the string blob, in id
+    order, then an open-addressing hash table of token id + 1 (0 for an
+    empty slot) indexed by crc32 of the token with linear probing, then the
+    blob itself. As in a dictionary built from the text file, a repeated
+    token is looked up as its last id.
+    """
+    table_size = 1
+    while table_size < 2 * len(rev_vocab):
+        table_size *= 2
+    table = [0] * table_size
+    for token_id, token in enumerate(rev_vocab):
+        slot = zlib.crc32(token) & (table_size - 1)
+        while table[slot] and rev_vocab[table[slot] - 1] != token:
+            slot = (slot + 1) & (table_size - 1)
+        table[slot] = token_id + 1
+    offsets = [0]
+    for token in rev_vocab:
+        offsets.append(offsets[-1] + len(token))
+    with open(path + ".tmp", "wb") as f:
+        f.write(_BINARY_HEADER.pack(_BINARY_MAGIC, len(rev_vocab), table_size,
+                                    source_size, source_mtime))
+        f.write(struct.pack("<%dI" % len(offsets), *offsets))
+        f.write(struct.pack("<%dI" % table_size, *table))
+        f.write(b"".join(rev_vocab))
+    os.rename(path + ".tmp", path)
+
+
+class BinaryVocabulary(object):
+    """A vocabulary memory-mapped from a write_binary_vocabulary file.
+
+    Loading maps the file and reads its header, whatever the size of the
+    vocabulary; tokens are read from the mapping when looked up. It answers
+    get(token, default), vocabulary[token], `token in vocabulary` and len()
+    like the dictionary of initialize_vocabulary, for tokens in bytes, and
+    reverse() gives the list-like view from ids to tokens.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(_BINARY_MAGIC)] != _BINARY_MAGIC:
+            raise ValueError("%s is not a binary vocabulary." % path)
+        (_, self._size, self._table_size, self.source_size,
+         self.source_mtime) = _BINARY_HEADER.unpack_from(self._data)
+        self._offsets_start = _BINARY_HEADER.size
+        self._table_start = self._offsets_start + 4 * (self._size + 1)
+        self._blob_start = self._table_start + 4 * self._table_size
+
+    def __len__(self):
+        return self._size
+
+    def token(self, token_id):
+        """The token of token_id, which must be in range."""
+        start, end = struct.unpack_from("<II", self._data, self._offsets_start + 4 * token_id)
+        return self._data[self._blob_start + start:self._blob_start + end]
+
+    def get(self, token, default=None):
+        """The id of token, or default if it is not in the vocabulary."""
+        mask = self._table_size - 1
+        slot = zlib.crc32(token) & mask
+        while True:
+            entry = _UINT32.unpack_from(self._data, self._table_start + 4 * slot)[0]
+            if not entry:
+                return default
+            if self.token(entry - 1) == token:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, token):
+        token_id = self.get(token)
+        if token_id is None:
+            raise KeyError(token)
+        return token_id
+
+    def __contains__(self, token):
+        return self.get(token) is not None
+
+    def reverse(self):
+        """The tokens by id, as a read-only sequence."""
+        return _ReversedBinaryVocabulary(self)
+
+
+class _ReversedBinaryVocabulary(object):
+
+    def __init__(self, vocabulary):
+        self._vocabulary = vocabulary
+
+    def __len__(self):
+        return len(self._vocabulary)
+
+    def __getitem__(self, token_id):
+        if not 0 <= token_id < len(self._vocabulary):
+            raise IndexError("Token id %d out of range." % token_id)
+        return self._vocabulary.token(token_id)
 
 
 def initialize_vocabulary(vocabulary_path):
@@ -165,6 +311,11 @@ def initialize_vocabulary(vocabulary_path):
     will result in a vocabulary {"dog": 0, "cat": 1}, and this function will
     also return the reversed-vocabulary ["dog", "cat"].
 
+    If create_vocabulary left a binary vocabulary next to the file and the
+    file has not changed since, that is mapped instead: a BinaryVocabulary
+    and its reverse(), which answer the lookups of the dictionary and the
+    list.
+
     Args:
       vocabulary_path: path to the file containing the vocabulary.
 
@@ -175,9 +326,12 @@ def initialize_vocabulary(vocabulary_path):
     Raises:
       ValueError: if the provided vocabulary_path does not exist.
     """
-    if gfile.Exists(vocabulary_path):
+    if os.path.exists(vocabulary_path):
+        vocab = _binary_vocabulary(vocabulary_path)
+        if vocab is not None:
+            return vocab, vocab.reverse()
         rev_vocab = []
-        with gfile.GFile(vocabulary_path, mode="rb") as f:
+        with open(vocabulary_path, mode="rb") as f:
             rev_vocab.extend(f.readlines())
         rev_vocab = [line.strip() for line in rev_vocab]
         vocab = dict([(x, y) for (y, x) in enumerate(rev_vocab)])
@@ -231,11 +385,14 @@ def data_to_token_ids(data_path, target_path, vocabulary_path,
         if None, basic_tokenizer will be used.
       normalize_digits: Boolean; if true, all digits are replaced by 0s.
     """
-    if not gfile.Exists(target_path):
+    if not os.path.exists(target_path):
         print("Tokenizing data in %s" % data_path)
-        vocab, _ = initialize_vocabulary(vocabulary_path)
-        with gfile.GFile(data_path, mode="rb") as data_file:
-            with gfile.GFile(target_path, mode="w") as tokens_file:
+        # A dictionary: its lookups are faster than the binary vocabulary's,
+        # which pays off over a whole corpus.
+        _, rev_vocab = initialize_vocabulary(vocabulary_path)
+        vocab = dict((rev_vocab[i], i) for i in range(len(rev_vocab)))
+        with open(data_path, mode="rb") as data_file:
+            with open(target_path, mode="w") as tokens_file:
                 counter = 0
                 for line in data_file:
                     counter += 1
@@ -300,5 +457,23 @@ def prepare_wmt_data(data_dir, en_vocabulary_size_1, en_vocabulary_size_2, fr_vo
             en_vocab_path_1, en_vocab_path_2, fr_vocab_path)
 
 
-if __name__ == '__main__':
-    prepare_wmt_data("gq_100w", 30000, 30000)
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(
+            description="Create the vocabularies and token ids of a data directory.")
+    parser.add_argument("--data_dir", default="../data_iwslt",
+                        help="directory with train.{en_1,en_2,fr} and dev.{en_1,en_2,fr}")
+    parser.add_argument("--en_vocab_size_1", type=int, default=15000,
+                        help="source vocabulary size")
+    parser.add_argument("--en_vocab_size_2", type=int, default=10000,
+                        help="draft vocabulary size")
+    parser.add_argument("--fr_vocab_size", type=int, default=10000,
+                        help="target vocabulary size")
+    args = parser.parse_args()
+
+    print("Preparing training and dev data in %s" % args.data_dir)
+    prepare_wmt_data(args.data_dir, args.en_vocab_size_1, args.en_vocab_size_2,
+                     args.fr_vocab_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Decode with several `translate.py --decode` processes pinned to cores.
+
+The source/draft pairs, read from stdin or --input_files in the layout set by
+--input_format (see pair_reader), are split into contiguous chunks of pairs,
+one per worker, and fed to the workers as line pairs. Each worker is pinned (with taskset) to its own set of cores,
+taken NUMA node by NUMA node so that a worker does not straddle two nodes
+when the counts allow, and runs its session with as many intra-op threads as
+it has cores and one inter-op thread. The translations are printed in input
+order. Arguments not listed below are passed on to translate.py:
+
+  python decode_parallel.py --num_workers 4 --model translate.ckpt-6000 < in
+
+With --benchmark, the first --benchmark_pairs pairs are decoded with each
+worker count that divides the number of cores, and the throughput of each
+layout is printed instead.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import glob
+import multiprocessing
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import pair_reader
+
+
+def _parse_cpulist(cpulist):
+    """The cores of a cpulist such as "0-3,8-11"."""
+    cores = []
+    for part in cpulist.strip().split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cores.extend(range(int(first), int(last) + 1))
+        elif part:
+            cores.append(int(part))
+    return cores
+
+
+def numa_cores():
+    """The cores of this machine, grouped by NUMA node."""
+    nodes = []
+    paths = glob.glob("/sys/devices/system/node/node*/cpulist")
+    for path in sorted(paths, key=lambda path: int(re.search(r"node(\d+)/", path).group(1))):
+        with open(path) as f:
+            cores = _parse_cpulist(f.read())
+        if cores:
+            nodes.append(cores)
+    return nodes or [list(range(multiprocessing.cpu_count()))]
+
+
+def _split(cores, num_sets):
+    """Split cores into num_sets contiguous sets of nearly equal size.
+
+    With more sets than cores, each set is one core, the cores taken in turn.
+    """
+    if num_sets > len(cores):
+        return [[cores[i % len(cores)]] for i in range(num_sets)]
+    return [cores[i * len(cores) // num_sets:(i + 1) * len(cores) // num_sets]
+            for i in range(num_sets)]
+
+
+def core_sets(num_workers, nodes=None):
+    """Split the cores into num_workers sets, none straddling two NUMA nodes.
+
+    The workers are shared out among the nodes in proportion to their cores,
+    and the cores of each node are split among its workers. With fewer
+    workers than nodes, each worker gets whole nodes instead.
+
+    Args:
+      num_workers: number of sets.
+      nodes: the cores grouped by node; defaults to numa_cores().
+    """
+    nodes = nodes or numa_cores()
+    if num_workers < len(nodes):
+        return [[core for node in group for core in node]
+                for group in _split(nodes, num_workers)]
+    total = sum(len(node) for node in nodes)
+    counts = [num_workers * len(node) // total for node in nodes]
+    # Largest remainders first; ties go to the first nodes.
+    remainders = sorted(range(len(nodes)),
+                        key=lambda i: (-(num_workers * len(nodes[i]) % total), i))
+    for i in remainders[:num_workers - sum(counts)]:
+        counts[i] += 1
+    return [cores for node, count in zip(nodes, counts) for cores in _split(node, count)]
+
+
+def _read_pairs(input_format, stream, paths):
+    """The input pairs, each as the bytes of its two lines."""
+    return [sentence_1.rstrip(b"\r\n") + b"\n" + sentence_2.rstrip(b"\r\n") + b"\n"
+            for sentence_1, sentence_2 in pair_reader.read_pairs(input_format, stream, paths)]
+
+
+def decode(pairs, num_workers, script, translate_args):
+    """Decode pairs with num_workers pinned processes.
+
+    Returns:
+      The list of output lines, in the order of pairs.
+
+    Raises:
+      RuntimeError: if a worker fails or does not print one line per pair.
+    """
+    size = (len(pairs) + num_workers - 1) // num_workers
+    chunks = [pairs[i * size:(i + 1) * size] for i in range(num_workers)]
+    outputs = [b""] * num_workers
+    workers, threads = [], []
+    for i, cores in enumerate(core_sets(num_workers)):
+        command = [sys.executable, script, "--decode",
+                   "--intra_op_threads=%d" % len(cores), "--inter_op_threads=1"]
+        command += translate_args
+        command = ["taskset", "-c", ",".join(str(core) for core in cores)] + command
+        workers.append(subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE))
+
+        def communicate(i=i, worker=workers[-1], data=b"".join(chunks[i])):
+            outputs[i] = worker.communicate(data)[0]
+        threads.append(threading.Thread(target=communicate))
+        threads[-1].start()
+    for thread in threads:
+        thread.join()
+    lines = []
+    for i, (worker, chunk, output) in enumerate(zip(workers, chunks, outputs)):
+        name = "Worker %d (pairs %d to %d)" % (i, i * size + 1, i * size + len(chunk))
+        if worker.returncode != 0:
+            raise RuntimeError("%s exited with status %d." % (name, worker.returncode))
+        chunk_lines = output.splitlines(True)
+        if len(chunk_lines) != len(chunk):
+            raise RuntimeError("%s printed %d lines for %d pairs."
+                               % (name, len(chunk_lines), len(chunk)))
+        lines.extend(chunk_lines)
+    return lines
+
+
+def benchmark(pairs, script, translate_args):
+    """Print the throughput of decoding pairs with each worker count."""
+    num_cores = sum(len(node) for node in numa_cores())
+    results = []
+    for num_workers in range(1, num_cores + 1):
+        if num_cores % num_workers:
+            continue
+        start_time = time.time()
+        decode(pairs, num_workers, script, translate_args)
+        elapsed = time.time() - start_time
+        results.append((len(pairs) / elapsed, num_workers))
+        print("%3d workers x %3d threads: %.2f sentences/sec (including startup)"
+              % (num_workers, num_cores // num_workers, results[-1][0]))
+        sys.stdout.flush()
+    best = max(results)
+    print("Best layout: %d workers x %d threads" % (best[1], num_cores // best[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num_workers", type=int, default=0,
+                        help="decoding processes (default: one per NUMA node)")
+    parser.add_argument("--script", default="translate.py",
+                        help="decoding script, e.g. translate_2nd.py")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="measure the throughput of each layout")
+    parser.add_argument("--benchmark_pairs", type=int, default=100,
+                        help="number of input pairs decoded per layout")
+    parser.add_argument("--input_format", default="lines", choices=pair_reader.INPUT_FORMATS,
+                        help="layout of the input, as for translate.py")
+    parser.add_argument("--input_files", default="",
+                        help="comma-separated parallel source and draft files for "
+                             "--input_format=files")
+    args, translate_args = parser.parse_known_args()
+    if args.input_format == "files" and len(args.input_files.split(",")) != 2:
+        parser.error("--input_format=files needs --input_files=SOURCE,DRAFT")
+
+    stdin = getattr(sys.stdin, "buffer", sys.stdin)
+    stdout = getattr(sys.stdout, "buffer", sys.stdout)
+    pairs = _read_pairs(args.input_format, stdin, args.input_files.split(","))
+    if args.benchmark:
+        benchmark(pairs[:args.benchmark_pairs], args.script, translate_args)
+        return
+    num_workers = args.num_workers or len(numa_cores())
+    for line in decode(pairs, num_workers, args.script, translate_args):
+        stdout.write(line)
+    stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
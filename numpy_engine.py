@@ -0,0 +1,490 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""NumPy-only inference for the dual-encoder attention model.
+
+This computes what `Seq2SeqModel` computes with forward_only=True: the two
+bidirectional GRU encoders over the source and the draft, the GRU decoder
+attending to both of them (`attention_1`, `attention_2`), the maxout
+`AttnOutputProjection`, the `proj_w` softmax and the beam search of
+seq2seq_al, without building a graph or opening a session. Weights come from
+a weights file (see checkpoint_utils and quantize.py) or, through TensorFlow's
+checkpoint reader, straight from a checkpoint. The matrices quantize.py stores
+in int8 stay int8 in memory: their products are computed a block of rows at a
+time, converting only that block to float32, and the per-column scales are
+applied to the columns of the result.
+
+Only the single-layer GRU configuration of translate.py is supported. The
+TensorFlow graph keeps the input dropout of training at decode time as well;
+this engine does not, so its translations can differ slightly.
+
+Input is read as in `translate.py --decode`, from stdin or --input_files in
+the layout set by --input_format (see pair_reader); one translation is printed
+per pair.
+
+  python numpy_engine.py --weights translate.ckpt-6000.npz < pairs
+  python numpy_engine.py --model translate.ckpt-6000 --num_workers 8 < pairs
+
+Several models given as a comma-separated list are decoded as an ensemble:
+one beam search over their averaged log-probabilities.
+
+  python numpy_engine.py --model translate.ckpt-5500,translate.ckpt-6000 < pairs
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import sys
+
+import numpy as np
+from six.moves import xrange  # pylint: disable=redefined-builtin
+
+import bucketing
+import checkpoint_utils
+import data_utils
+import pair_reader
+
+# Same as translate.py.
+_buckets = [(5, 10, 10), (10, 15, 15), (20, 25, 25), (45, 50, 50)]
+
+# seq2seq_al.alpha and seq2seq_al.beta, the weights of the two encoders.
+_ALPHA = 1.0
+_BETA = 1.0
+
+# Elements of an int8 matrix converted to float32 at a time by _Int8Matrix.
+_BLOCK_ELEMENTS = 1 << 16
+
+_SCOPE = "embedding_attention_seq2seq/"
+_DECODER_SCOPE = _SCOPE + "embedding_attention_decoder/"
+
+# An encoded sentence pair. attention_states and hidden_features hold one
+# entry per encoder: the encoder outputs [length x 2*hidden] and their AttnW
+# features [length x hidden]. state is the initial decoder state [1 x hidden].
+EncoderOutputs = collections.namedtuple(
+        "EncoderOutputs", ("attention_states", "hidden_features", "state"))
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _log_softmax(x):
+    x = x - x.max(axis=1, keepdims=True)
+    return x - np.log(np.exp(x).sum(axis=1, keepdims=True))
+
+
+def _top_k(x, k):
+    """Values and indices of the k largest entries of vector x, largest first.
+
+    Ties go to the lower index, as in nn_ops.top_k.
+    """
+    if k < x.size:
+        indices = np.argpartition(-x, k - 1)[:k]
+    else:
+        indices = np.arange(x.size)
+    indices = indices[np.lexsort((indices, -x[indices]))]
+    return x[indices], indices
+
+
+class _Int8Matrix(object):
+    """An int8 matrix and its per-column float32 scales, as quantize.py writes.
+
+    Stands for the matrix q * scale; rows are sliced like an array's.
+    """
+
+    def __init__(self, q, scale):
+        self.q = q
+        self.scale = scale
+
+    @property
+    def shape(self):
+        return self.q.shape
+
+    def __getitem__(self, rows):
+        return _Int8Matrix(self.q[rows], self.scale)
+
+    def rdot(self, x):
+        """x.dot(q * scale) for a float matrix x [n x rows]."""
+        rows = max(1, _BLOCK_ELEMENTS // self.q.shape[1])
+        product = np.zeros((len(x), self.q.shape[1]), dtype=np.float32)
+        for start in xrange(0, len(self.q), rows):
+            product += x[:, start:start + rows].dot(
+                    self.q[start:start + rows].astype(np.float32))
+        return product * self.scale
+
+
+def _dot(x, w):
+    """x.dot(w) for a float matrix or an _Int8Matrix w."""
+    if isinstance(w, _Int8Matrix):
+        return w.rdot(x)
+    return x.dot(w)
+
+
+class _Weights(object):
+    """Read access to a weights dict that reports missing variables."""
+
+    def __init__(self, weights, scales=None):
+        self._weights = weights
+        self._scales = scales or {}
+
+    def __getitem__(self, name):
+        if name not in self._weights:
+            raise ValueError("Variable %s is missing from the weights." % name)
+        if name in self._scales:
+            return self._weights[name].astype(np.float32) * self._scales[name]
+        return np.asarray(self._weights[name], dtype=np.float32)
+
+    def matrix(self, name):
+        """The variable as an _Int8Matrix if it is quantized, else as [name]."""
+        if name in self._scales:
+            return _Int8Matrix(self._weights[name], self._scales[name])
+        return self[name]
+
+
+class _GRU(object):
+    """The weights of a GRUCell, split into input rows and recurrent rows.
+
+    The recurrent rows multiply the state, followed by the context if the cell
+    takes one (the attention read in the decoder).
+    """
+
+    def __init__(self, weights, scope, input_size):
+        gates = weights.matrix(scope + "GRUCell/Gates/Linear/Matrix")
+        candidate = weights.matrix(scope + "GRUCell/Candidate/Linear/Matrix")
+        self.num_units = candidate.shape[1]
+        self.gates_input = gates[:input_size]
+        self.gates_recurrent = gates[input_size:]
+        self.candidate_input = candidate[:input_size]
+        self.candidate_recurrent = candidate[input_size:]
+
+    def project_inputs(self, inputs):
+        """The input terms of the gates and the candidate for all of inputs."""
+        return _dot(inputs, self.gates_input), _dot(inputs, self.candidate_input)
+
+    def __call__(self, gates, candidate, state, context=None):
+        """One step from the projected inputs; returns the new state."""
+        recurrent = state if context is None else np.concatenate([state, context], 1)
+        r, u = np.split(_sigmoid(gates + _dot(recurrent, self.gates_recurrent)), 2, axis=1)
+        recurrent = r * state if context is None else np.concatenate([r * state, context], 1)
+        c = np.tanh(candidate + _dot(recurrent, self.candidate_recurrent))
+        return u * state + (1 - u) * c
+
+    def run(self, inputs):
+        """Run over inputs [length x input_size] from the zero state.
+
+        Returns:
+          The outputs [length x num_units]; the last one is the final state.
+        """
+        gates, candidate = self.project_inputs(inputs)
+        state = np.zeros((1, self.num_units), dtype=np.float32)
+        outputs = np.zeros((len(inputs), self.num_units), dtype=np.float32)
+        for t in xrange(len(inputs)):
+            state = self(gates[t:t + 1], candidate[t:t + 1], state)
+            outputs[t] = state
+        return outputs
+
+
+class Seq2SeqEngine(object):
+    """A translate.py model held in numpy arrays."""
+
+    def __init__(self, weights, scales=None):
+        """Take the model variables from weights.
+
+        Args:
+          weights: a dict from variable name to numpy array, as returned by
+            checkpoint_utils.read_checkpoint or load_weights.
+          scales: the per-column scales of the int8 entries of weights, as
+            returned by load_weights with dequantize=False.
+
+        Raises:
+          ValueError: if a variable of the model is missing from weights.
+        """
+        weights = _Weights(weights, scales)
+        attention_scope = _DECODER_SCOPE + "attention_decoder/"
+        self.decoder_embedding = weights[_DECODER_SCOPE + "embedding"]
+        embedding_size = self.decoder_embedding.shape[1]
+
+        self._encoders = []
+        for k in (1, 2):
+            scope = _SCOPE + "encoder_%d/BiRNN_" % k
+            self._encoders.append((weights[_SCOPE + "embedding_%d" % k],
+                                   _GRU(weights, scope + "FW/", embedding_size),
+                                   _GRU(weights, scope + "BW/", embedding_size)))
+
+        self._initial_state = weights[attention_scope + "Linear/Matrix"]
+        self._attentions = []
+        for k in (1, 2):
+            scope = attention_scope + "attention_%d/" % k
+            attn_w = weights[scope + "AttnW_0"]
+            self._attentions.append((attn_w.reshape(attn_w.shape[-2:]),
+                                     weights[scope + "AttnV_0"],
+                                     weights[scope + "AttnU_0/Linear/Matrix"]))
+        self._cell = _GRU(weights, attention_scope, embedding_size)
+        self._output_projection = weights.matrix(
+                attention_scope + "AttnOutputProjection/Linear/Matrix")
+        self._proj_w = weights.matrix("proj_w")
+        self._proj_b = weights["proj_b"]
+
+    def encode(self, token_ids_1, token_ids_2):
+        """Run both encoders over one sentence pair.
+
+        Args:
+          token_ids_1: list of source token ids.
+          token_ids_2: list of draft token ids.
+
+        Returns:
+          The EncoderOutputs of the pair.
+        """
+        attention_states, hidden_features = [], []
+        encoder_state = 0.0
+        for token_ids, weight, (embedding, cell_fw, cell_bw), (attn_w, _, _) in zip(
+                (token_ids_1, token_ids_2), (_ALPHA, _BETA), self._encoders,
+                self._attentions):
+            inputs = embedding[np.asarray(token_ids, dtype=np.int64)]
+            outputs_fw = cell_fw.run(inputs)
+            outputs_bw = cell_bw.run(inputs[::-1])[::-1]
+            states = np.concatenate([outputs_fw, outputs_bw], 1)
+            attention_states.append(states)
+            hidden_features.append(states.dot(attn_w))
+            if len(token_ids):
+                encoder_state = encoder_state + weight * outputs_bw[:1]
+        if np.isscalar(encoder_state):
+            encoder_state = np.zeros((1, self._cell.num_units), dtype=np.float32)
+        return EncoderOutputs(attention_states, hidden_features,
+                              np.tanh(encoder_state.dot(self._initial_state)))
+
+    def _attention(self, encoded, state):
+        """The attention read of both encoders for each row of state."""
+        attns = 0.0
+        for states, features, (_, attn_v, attn_u), weight in zip(
+                encoded.attention_states, encoded.hidden_features,
+                self._attentions, (_ALPHA, _BETA)):
+            if not len(states):
+                continue
+            s = np.tanh(features[np.newaxis] + state.dot(attn_u)[:, np.newaxis]).dot(attn_v)
+            a = np.exp(s - s.max(axis=1, keepdims=True))
+            a /= a.sum(axis=1, keepdims=True)
+            attns = attns + weight * a.dot(states)
+        if np.isscalar(attns):
+            attns = np.zeros((len(state), 2 * self._cell.num_units), dtype=np.float32)
+        return attns
+
+    def step(self, encoded, state, symbols):
+        """One decoder step for a beam.
+
+        Args:
+          encoded: EncoderOutputs of the sentence pair.
+          state: decoder states [beam x hidden].
+          symbols: the previous symbol of each beam entry (GO_ID first).
+
+        Returns:
+          A pair (log_probs, state): the log-probabilities of the next symbol
+          [beam x target vocabulary] and the new states [beam x hidden].
+        """
+        inputs = self.decoder_embedding[symbols]
+        attns = self._attention(encoded, state)
+        gates, candidate = self._cell.project_inputs(inputs)
+        state = self._cell(gates, candidate, state, attns)
+        output = _dot(np.concatenate([state, inputs, attns], 1), self._output_projection)
+        output = output.reshape(len(output), -1, 2).max(axis=2)
+        return _log_softmax(_dot(output, self._proj_w) + self._proj_b), state
+
+
+def beam_search(engines, token_ids_1, token_ids_2, beam_size, decoder_size,
+                pool=None):
+    """Translate one sentence pair as the beam search of seq2seq_al does.
+
+    Like the graph, the search runs for exactly decoder_size steps and keeps
+    the best beam_size prefixes of all extensions at each step. With several
+    engines the search is run once on the average of their log-probabilities.
+
+    Args:
+      engines: a Seq2SeqEngine or a list of them (an ensemble).
+      token_ids_1: list of source token ids.
+      token_ids_2: list of draft token ids.
+      beam_size: number of prefixes kept at each step.
+      decoder_size: number of steps.
+      pool: optional thread pool to run the encoders of an ensemble in.
+
+    Returns:
+      The token ids of the best translation, cut at the first EOS.
+    """
+    if isinstance(engines, Seq2SeqEngine):
+        engines = [engines]
+    encode = lambda engine: engine.encode(token_ids_1, token_ids_2)
+    encoded = pool.map(encode, engines) if pool else [encode(e) for e in engines]
+    states = [e.state for e in encoded]
+    symbols = np.array([data_utils.GO_ID])
+    scores = np.zeros(1, dtype=np.float32)
+    history = np.zeros((1, 0), dtype=np.int64)
+    for _ in xrange(decoder_size):
+        log_probs = 0.0
+        for k, engine in enumerate(engines):
+            engine_log_probs, states[k] = engine.step(encoded[k], states[k], symbols)
+            log_probs = log_probs + engine_log_probs
+        log_probs /= len(engines)
+        num_symbols = log_probs.shape[1]
+        scores, best = _top_k((log_probs + scores[:, np.newaxis]).ravel(), beam_size)
+        index, symbols = best // num_symbols, best % num_symbols
+        states = [state[index] for state in states]
+        history = np.concatenate([history[index], symbols[:, np.newaxis]], 1)
+    outputs = [int(symbol) for symbol in history[0]]
+    if data_utils.EOS_ID in outputs:
+        outputs = outputs[:outputs.index(data_utils.EOS_ID)]
+    return outputs
+
+
+def _read_weights(path):
+    """The pair (weights, scales) of a weights file or a checkpoint."""
+    if path.endswith(".npz"):
+        return checkpoint_utils.load_weights(path, dequantize=False)
+    return checkpoint_utils.read_checkpoint(path), {}
+
+
+def load_engine(path):
+    """A Seq2SeqEngine from a weights file (.npz) or a checkpoint."""
+    return Seq2SeqEngine(*_read_weights(path))
+
+
+def load_engines(paths):
+    """Seq2SeqEngines for an ensemble of weights files or checkpoints.
+
+    Variables that hold the same values in several models, such as the
+    constant embeddings, are kept in memory only once.
+    """
+    engines, shared = [], {}
+    for path in paths:
+        weights, scales = _read_weights(path)
+        for name, value in weights.items():
+            if name not in scales:
+                weights[name] = value = np.asarray(value, dtype=np.float32)
+            if name not in shared:
+                shared[name] = value
+            elif (shared[name].shape == value.shape and
+                  shared[name].dtype == value.dtype and
+                  np.array_equal(shared[name], value)):
+                weights[name] = shared[name]
+        engines.append(Seq2SeqEngine(weights, scales))
+    return engines
+
+
+def bucket_for(token_ids_1, token_ids_2):
+    """The bucket translate.py decodes a (truncated) pair in."""
+    for bucket_id, (size_1, size_2, _) in enumerate(_buckets):
+        if size_1 > len(token_ids_1) and size_2 > len(token_ids_2):
+            return bucket_id
+    return len(_buckets) - 1
+
+
+class Translator(object):
+    """Vocabularies and engines: text pairs in, translations out."""
+
+    def __init__(self, engines, data_dir, en_vocab_size_1, en_vocab_size_2,
+                 fr_vocab_size, beam_size):
+        self.engines = engines
+        self.beam_size = beam_size
+        self.en_vocab_1, _ = data_utils.initialize_vocabulary(
+                os.path.join(data_dir, "vocab%d.en_1" % en_vocab_size_1))
+        self.en_vocab_2, _ = data_utils.initialize_vocabulary(
+                os.path.join(data_dir, "vocab%d.en_2" % en_vocab_size_2))
+        _, self.rev_fr_vocab = data_utils.initialize_vocabulary(
+                os.path.join(data_dir, "vocab%d.fr" % fr_vocab_size))
+        # Created on first use, so that each worker process has its own.
+        self._pool = None
+
+    def translate(self, sentence_1, sentence_2):
+        """Translate one pair of byte strings into a byte string."""
+        if self._pool is None and len(self.engines) > 1:
+            self._pool = ThreadPool(len(self.engines))
+        token_ids_1 = data_utils.sentence_to_token_ids(sentence_1, self.en_vocab_1)
+        token_ids_2 = data_utils.sentence_to_token_ids(sentence_2, self.en_vocab_2)
+        token_ids_1 = token_ids_1[:_buckets[-1][0]]
+        token_ids_2 = token_ids_2[:_buckets[-1][1]]
+        decoder_size = _buckets[bucket_for(token_ids_1, token_ids_2)][2]
+        outputs = beam_search(self.engines, token_ids_1, token_ids_2,
+                              self.beam_size, decoder_size, pool=self._pool)
+        return b" ".join(self.rev_fr_vocab[output] for output in outputs)
+
+
+# The Translator of the worker processes, inherited from the parent on fork.
+_worker_translator = None
+
+
+def _translate_pair(pair):
+    return _worker_translator.translate(*pair)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--data_dir", default="../data_iwslt", help="Data directory")
+    parser.add_argument("--train_dir", default="../train_iwslt", help="Training directory.")
+    parser.add_argument("--en_vocab_size_1", type=int, default=15000)
+    parser.add_argument("--en_vocab_size_2", type=int, default=10000)
+    parser.add_argument("--fr_vocab_size", type=int, default=10000)
+    parser.add_argument("--beam_size", type=int, default=5)
+    parser.add_argument("--buckets", default="",
+                        help="bucket sizes the model is decoded with, as for translate.py")
+    parser.add_argument("--model", default="",
+                        help="checkpoint in train_dir to read, e.g. translate.ckpt-6000; "
+                             "several comma-separated ones are decoded as an ensemble")
+    parser.add_argument("--weights", default="",
+                        help="weights file in train_dir to load (see quantize.py); "
+                             "several comma-separated ones are decoded as an ensemble")
+    parser.add_argument("--num_workers", type=int, default=1,
+                        help="number of decoding processes")
+    parser.add_argument("--input_format", default="lines", choices=pair_reader.INPUT_FORMATS,
+                        help="layout of the input, as for translate.py")
+    parser.add_argument("--input_files", default="",
+                        help="comma-separated parallel source and draft files for "
+                             "--input_format=files")
+    args = parser.parse_args()
+    if args.input_format == "files" and len(args.input_files.split(",")) != 2:
+        parser.error("--input_format=files needs --input_files=SOURCE,DRAFT")
+    if args.buckets:
+        _buckets[:] = bucketing.parse_buckets(args.buckets)
+    models = [m for m in args.model.split(",") + args.weights.split(",") if m]
+    if not models:
+        parser.error("--model or --weights is required")
+
+    global _worker_translator
+    engines = load_engines([os.path.join(args.train_dir, m) for m in models])
+    _worker_translator = Translator(engines, args.data_dir, args.en_vocab_size_1,
+                                    args.en_vocab_size_2, args.fr_vocab_size,
+                                    args.beam_size)
+
+    stdin = getattr(sys.stdin, "buffer", sys.stdin)
+    stdout = getattr(sys.stdout, "buffer", sys.stdout)
+    pairs = pair_reader.read_pairs(args.input_format, stdin, args.input_files.split(","))
+    if args.num_workers > 1:
+        pool = multiprocessing.Pool(args.num_workers)
+        translations = pool.imap(_translate_pair, pairs, chunksize=4)
+    else:
+        pool = None
+        translations = (_translate_pair(pair) for pair in pairs)
+    for translation in translations:
+        stdout.write(translation + b"\n")
+        stdout.flush()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Streaming the source/draft pairs to decode, with bounded read-ahead.
+
+The input is read one pair at a time, so files of any size pass through in
+constant memory. Three layouts are read:
+
+  lines   two consecutive lines per pair, the source and then the draft;
+  tsv     one line per pair, source and draft separated by a tab, as in res;
+  files   two parallel files, the sources and the drafts.
+
+prefetch() runs the reading and the tokenizing in a helper thread, ahead of
+the decoder, while the decoder's session runs release the interpreter.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+
+from six.moves import queue
+from six.moves import zip_longest
+
+INPUT_FORMATS = ("lines", "tsv", "files")
+
+_END = object()
+
+
+def read_pairs(input_format, stream=None, paths=None):
+    """Yield the (sentence_1, sentence_2) pairs of the input.
+
+    The sentences are str or bytes as read from stream; the files of the
+    "files" format are read as bytes.
+
+    Args:
+      input_format: one of INPUT_FORMATS.
+      stream: the input of the "lines" and "tsv" formats, e.g. sys.stdin.
+      paths: the source and draft files of the "files" format.
+
+    Raises:
+      ValueError: for an unknown format, a tsv line without one tab, or
+        parallel files of different lengths.
+    """
+    if input_format == "lines":
+        while True:
+            sentence_1, sentence_2 = stream.readline(), stream.readline()
+            if not (sentence_1 and sentence_2):
+                return
+            yield sentence_1, sentence_2
+    elif input_format == "tsv":
+        # readline rather than iteration, which reads ahead on Python 2 and
+        # would hold back interactive input.
+        while True:
+            line = stream.readline()
+            if not line:
+                return
+            if isinstance(line, bytes):
+                fields = line.rstrip(b"\r\n").split(b"\t")
+            else:
+                fields = line.rstrip("\r\n").split("\t")
+            if len(fields) != 2:
+                raise ValueError("Expected source<TAB>draft, got %r." % line)
+            yield fields[0], fields[1]
+    elif input_format == "files":
+        with open(paths[0], "rb") as source_file, open(paths[1], "rb") as draft_file:
+            for sentence_1, sentence_2 in zip_longest(source_file, draft_file):
+                if sentence_1 is None or sentence_2 is None:
+                    raise ValueError("%s and %s have different numbers of lines."
+                                     % (paths[0], paths[1]))
+                yield sentence_1, sentence_2
+    else:
+        raise ValueError("Unknown input format %r, expected one of %s."
+                         % (input_format, ", ".join(INPUT_FORMATS)))
+
+
+def prefetch(items, function, read_ahead):
+    """Yield function(item) for each of items, computed in a helper thread.
+
+    The thread runs at most read_ahead results ahead of the consumer. An
+    exception raised while reading items or in function is raised again in
+    the consumer.
+    """
+    results = queue.Queue(maxsize=read_ahead)
+
+    def produce():
+        try:
+            for item in items:
+                results.put((function(item), None))
+        except Exception as e:  # pylint: disable=broad-except
+            results.put((None, e))
+            return
+        results.put((_END, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    while True:
+        result, error = results.get()
+        if error is not None:
+            raise error
+        if result is _END:
+            return
+        yield result
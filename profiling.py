@@ -0,0 +1,150 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Tracing sampled session runs and attributing op time to model scopes.
+
+A Profiler attached to a Seq2SeqModel (model.profiler) makes every n-th call
+of step() run with a full trace. Each trace is written as a Chrome trace
+(open chrome://tracing and load the file) and its op times are added to a
+table by model scope, forward and backward, next to the time spent in Python
+on building batches and feeds.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import os
+import re
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+# Scopes of the table, tried in order on op names (without the gradients/
+# prefix); the first one contained in the name wins.
+SCOPES = [
+    ("encoder_1", "/encoder_1/"),
+    ("encoder_2", "/encoder_2/"),
+    ("attention_1", "/attention_1/"),
+    ("attention_2", "/attention_2/"),
+    ("AttnOutputProjection", "/AttnOutputProjection/"),
+    ("decoder GRUCell", "/attention_decoder/GRUCell/"),
+    ("loss", "sequence_loss"),
+    ("gradient clipping", "global_norm"),
+    ("optimizer", "Adam"),
+    ("optimizer", "beta1_power"),
+    ("optimizer", "beta2_power"),
+    ("optimizer", "gradient_accumulators"),
+]
+
+_GRADIENTS_RE = re.compile(r"^(replica_\d+/)?gradients(_\d+)?/")
+
+
+def op_scope(node_name):
+    """The pair (scope, is_backward) an op of the model is counted under."""
+    backward = _GRADIENTS_RE.match(node_name) is not None
+    name = "/" + _GRADIENTS_RE.sub("", node_name)
+    for scope, pattern in SCOPES:
+        if pattern in name:
+            return scope, backward
+    return "other", backward
+
+
+class Profiler(object):
+    """Traces every n-th session run of a model and aggregates the traces."""
+
+    def __init__(self, every_n_steps, output_dir):
+        """Create the profiler.
+
+        Args:
+          every_n_steps: trace one session run in this many.
+          output_dir: directory for the timelines and the scope table.
+        """
+        self.every_n_steps = every_n_steps
+        self.output_dir = output_dir
+        self.num_traces = 0
+        self._steps = 0
+        # Microseconds by (scope, is_backward), summed over traced runs.
+        self._op_micros = collections.defaultdict(int)
+        # Seconds of Python work by label, summed over traced runs.
+        self._python_seconds = collections.defaultdict(float)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+    def next_is_traced(self):
+        """Whether the next run counted by should_trace will be traced."""
+        return (self._steps + 1) % self.every_n_steps == 0
+
+    def should_trace(self):
+        """Count a run; whether to trace it."""
+        self._steps += 1
+        return self._steps % self.every_n_steps == 0
+
+    def run(self, session, fetches, feed_dict, name):
+        """session.run(fetches, feed_dict) with a full trace.
+
+        The trace is added to the table and written to
+        output_dir/timeline_<run>_<name>.json.
+        """
+        options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+        outputs = session.run(fetches, feed_dict, options=options,
+                              run_metadata=run_metadata)
+        self.add_trace(run_metadata.step_stats)
+        trace = timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format()
+        filename = "timeline_%06d_%s.json" % (self._steps, name)
+        with open(os.path.join(self.output_dir, filename), "w") as f:
+            f.write(trace)
+        return outputs
+
+    def add_trace(self, step_stats):
+        """Add the op times of a traced run to the table."""
+        self.num_traces += 1
+        for device_stats in step_stats.dev_stats:
+            for node_stats in device_stats.node_stats:
+                self._op_micros[op_scope(node_stats.node_name)] += node_stats.all_end_rel_micros
+
+    def add_python_time(self, label, seconds):
+        """Add time spent in Python (e.g. "get_batch") during a traced run."""
+        self._python_seconds[label] += seconds
+
+    def table(self):
+        """The table of average milliseconds per traced run, by scope."""
+        runs = max(self.num_traces, 1)
+        total = sum(self._op_micros.values()) or 1
+        scopes = []
+        for scope, _ in SCOPES + [("other", None)]:
+            if scope not in scopes:
+                scopes.append(scope)
+        lines = ["%-22s %10s %10s %7s" % ("op time per run", "fwd ms", "bwd ms", "share")]
+        for scope in scopes:
+            forward = self._op_micros.get((scope, False), 0)
+            backward = self._op_micros.get((scope, True), 0)
+            if forward or backward:
+                lines.append("%-22s %10.2f %10.2f %6.1f%%" % (
+                        scope, forward / 1000.0 / runs, backward / 1000.0 / runs,
+                        100.0 * (forward + backward) / total))
+        for label in sorted(self._python_seconds):
+            lines.append("%-22s %10.2f   (python)" % (
+                    label, 1000.0 * self._python_seconds[label] / runs))
+        lines.append("%d traced runs; op times on parallel threads add up." % self.num_traces)
+        return "\n".join(lines)
+
+    def write_table(self):
+        """Write the table to output_dir/scopes.txt and return it."""
+        table = self.table()
+        with open(os.path.join(self.output_dir, "scopes.txt"), "w") as f:
+            f.write(table + "\n")
+        return table
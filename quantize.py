@@ -0,0 +1,116 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Export a checkpoint as int8 weights for inference.
+
+The output projection `proj_w`, the `AttnOutputProjection` matrix and the GRU
+gate and candidate matrices are quantized to int8 with one float32 scale per
+output channel (column); every other inference variable is kept in float32.
+The result is a weights file (see checkpoint_utils) that can be decoded with
+
+  python numpy_engine.py --weights translate.ckpt-N.int8.npz
+
+which keeps the int8 matrices in memory and computes with them, or with
+
+  python translate.py --decode --weights translate.ckpt-N.int8.npz
+
+which dequantizes them to float32 at load, and compared to the float32
+checkpoint with test_quantized.sh.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import re
+
+import numpy as np
+import tensorflow as tf
+
+import checkpoint_utils
+
+tf.app.flags.DEFINE_string("train_dir", "../train_iwslt", "Training directory.")
+tf.app.flags.DEFINE_string("model", "ckpt", "the checkpoint model to quantize")
+tf.app.flags.DEFINE_string("output", "", "output weights file; defaults to <model>.int8.npz")
+
+FLAGS = tf.app.flags.FLAGS
+
+# Variables stored in int8; they hold nearly all of the decoder's weight bytes.
+_QUANTIZED_RE = re.compile(r"(^proj_w"
+                           r"|/AttnOutputProjection/Linear/Matrix"
+                           r"|/GRUCell/(Gates|Candidate)/Linear/Matrix)$")
+
+
+def is_quantized_variable(name):
+    """Whether variable `name` is stored in int8 by quantize_weights."""
+    return _QUANTIZED_RE.search(name) is not None
+
+
+def quantize_per_channel(w):
+    """Symmetric int8 quantization of a matrix with one scale per column.
+
+    Args:
+      w: float numpy array of shape [rows x columns].
+
+    Returns:
+      A pair (q, scale): int8 array q of the shape of w and float32 array
+      scale of shape [columns], such that w ~= q * scale.
+    """
+    scale = np.abs(w).max(axis=0) / 127.0
+    scale[scale == 0.0] = 1.0
+    q = np.clip(np.round(w / scale), -127, 127).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+
+def quantize_weights(weights):
+    """Quantize the large inference matrices of weights.
+
+    Args:
+      weights: a dict from variable name to numpy array.
+
+    Returns:
+      A pair (weights, scales) as taken by checkpoint_utils.save_weights.
+    """
+    quantized, scales = {}, {}
+    for name, w in weights.items():
+        if is_quantized_variable(name):
+            quantized[name], scales[name] = quantize_per_channel(w)
+        else:
+            quantized[name] = w
+    return quantized, scales
+
+
+def main(_):
+    checkpoint_path = os.path.join(FLAGS.train_dir, FLAGS.model)
+    output_path = FLAGS.output or checkpoint_path + ".int8.npz"
+    weights = checkpoint_utils.read_checkpoint(checkpoint_path)
+    quantized, scales = quantize_weights(weights)
+    float_bytes, stored_bytes = 0, 0
+    for name in sorted(weights):
+        float_bytes += weights[name].nbytes
+        stored_bytes += quantized[name].nbytes
+        if name in scales:
+            stored_bytes += scales[name].nbytes
+            restored = quantized[name].astype(np.float32) * scales[name]
+            error = (np.linalg.norm(restored - weights[name]) /
+                     max(np.linalg.norm(weights[name]), 1e-12))
+            print("%s %s relative error %.5f" % (name, weights[name].shape, error))
+    checkpoint_utils.save_weights(output_path, quantized, scales)
+    print("Wrote %s: %.1f MB (float32 %.1f MB)"
+          % (output_path, stored_bytes / 2.0 ** 20, float_bytes / 2.0 ** 20))
+
+
+if __name__ == "__main__":
+    tf.app.run()
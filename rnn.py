@@ -95,6 +95,10 @@ def rnn(cell, inputs, initial_state=None, dtype=None,
     and properly propagates the state at an example's sequence length
     to the final state output.
 
+    If the cell can precompute its input projections (see
+    `RNNCell.project_inputs`), they are computed for all steps before the loop
+    and only the recurrent part of the cell is run at each step.
+
     The dynamic calculation performed is, at time t for batch row b,
       (output, state)(b, t) =
         (t >= sequence_length(b))
@@ -203,10 +207,17 @@ def rnn(cell, inputs, initial_state=None, dtype=None,
             min_sequence_length = math_ops.reduce_min(sequence_length)
             max_sequence_length = math_ops.reduce_max(sequence_length)
 
+        projections = None
+        if not nest.is_sequence(inputs[0]):
+            projections = cell.project_inputs(inputs)
+
         for time, input_ in enumerate(inputs):
             if time > 0: varscope.reuse_variables()
             # pylint: disable=cell-var-from-loop
-            call_cell = lambda: cell(input_, state)
+            if projections is not None:
+                call_cell = lambda: cell.call_projected(projections[time], state)
+            else:
+                call_cell = lambda: cell(input_, state)
             # pylint: enable=cell-var-from-loop
             if sequence_length is not None:
                 (output, state) = _rnn_step(
@@ -474,9 +485,95 @@ def _reverse_seq(input_seq, lengths):
     return results
 
 
+def _stacked_directions_rnn(cell_fw, cell_bw, inputs_fw, inputs_bw,
+                            initial_state_fw, initial_state_bw, dtype,
+                            sequence_length, name):
+    """Run a forward and a backward RNN as one recurrence of stacked states.
+
+    Both cells project their inputs in their own "_FW" / "_BW" scopes, exactly
+    as `rnn` would, so variables and checkpoints are shared with the default
+    path. The per-step projections and the two states are then packed on a
+    leading axis of size 2 and advanced by a single `call_projected` per step,
+    which runs the two directions' recurrent matmuls as one batched matmul.
+
+    Args:
+      cell_fw, cell_bw: RNNCells with the same structure, supporting
+        `project_inputs`; usually the same object.
+      inputs_fw: the length T list of inputs, in order.
+      inputs_bw: the same inputs reversed up to `sequence_length`.
+      initial_state_fw, initial_state_bw: optional initial states.
+      dtype: data type of the zero initial states.
+      sequence_length: optional int vector of size `[batch_size]`.
+      name: prefix of the "_FW" and "_BW" variable scopes.
+
+    Returns:
+      A tuple (outputs_fw, state_fw, outputs_bw, state_bw), where outputs_bw
+      are still in reversed order.
+
+    Raises:
+      ValueError: if the cells cannot precompute their inputs or have a
+        nested state.
+    """
+    if nest.is_sequence(cell_fw.state_size) or nest.is_sequence(inputs_fw[0]):
+        raise ValueError("stack_directions needs cells with a single state "
+                         "tensor and non-nested inputs.")
+    batch_size = array_ops.shape(inputs_fw[0])[0]
+    with vs.variable_scope(name + "_FW"):
+        projections_fw = cell_fw.project_inputs(inputs_fw)
+        if initial_state_fw is None:
+            if not dtype:
+                raise ValueError("If no initial_state is provided, "
+                                 "dtype must be specified")
+            initial_state_fw = cell_fw.zero_state(batch_size, dtype)
+    with vs.variable_scope(name + "_BW"):
+        projections_bw = cell_bw.project_inputs(inputs_bw)
+        if initial_state_bw is None:
+            if not dtype:
+                raise ValueError("If no initial_state is provided, "
+                                 "dtype must be specified")
+            initial_state_bw = cell_bw.zero_state(batch_size, dtype)
+    if projections_fw is None or projections_bw is None:
+        raise ValueError("stack_directions needs cells implementing "
+                         "project_inputs.")
+
+    with ops.name_scope(name + "_Stacked"):
+        # Tensors shared by all steps (e.g. the recurrent weights) are packed once.
+        packed = {}
+
+        def _pack(fw, bw):
+            if (fw, bw) not in packed:
+                packed[(fw, bw)] = array_ops.pack([fw, bw])
+            return packed[(fw, bw)]
+
+        state = array_ops.pack([initial_state_fw, initial_state_bw])
+        if sequence_length is not None:
+            sequence_length = math_ops.to_int32(sequence_length)
+
+        outputs_fw, outputs_bw = [], []
+        for time, (proj_fw, proj_bw) in enumerate(zip(projections_fw, projections_bw)):
+            projection = nest.pack_sequence_as(
+                    structure=proj_fw,
+                    flat_sequence=[_pack(fw, bw) for fw, bw in
+                                   zip(nest.flatten(proj_fw), nest.flatten(proj_bw))])
+            output, new_state = cell_fw.call_projected(projection, state)
+            if sequence_length is not None:
+                # Past the end of a sequence, keep its state and output zeros.
+                mask = math_ops.cast(array_ops.reshape(
+                        time < sequence_length, [1, -1, 1]), new_state.dtype)
+                output = mask * output
+                new_state = mask * new_state + (1 - mask) * state
+            state = new_state
+            output_fw, output_bw = array_ops.unpack(output)
+            outputs_fw.append(output_fw)
+            outputs_bw.append(output_bw)
+        state_fw, state_bw = array_ops.unpack(state)
+    return outputs_fw, state_fw, outputs_bw, state_bw
+
+
 def bidirectional_rnn(cell_fw, cell_bw, inputs,
                       initial_state_fw=None, initial_state_bw=None,
-                      dtype=None, sequence_length=None, scope=None):
+                      dtype=None, sequence_length=None, scope=None,
+                      stack_directions=False):
     """Creates a bidirectional recurrent neural network.
 
     Similar to the unidirectional case above (rnn) but takes input and builds
@@ -488,6 +585,11 @@ def bidirectional_rnn(cell_fw, cell_bw, inputs,
     ever returned -- the network is fully unrolled for the given (passed in)
     length(s) of the sequence(s) or completely unrolled if length(s) is not given.
 
+    The two directions share no ops, so the executor is free to run them
+    concurrently (given `inter_op_parallelism_threads` > 1). Passing the same
+    cell object as `cell_fw` and `cell_bw` is fine: each direction creates its
+    variables in its own "_FW" / "_BW" scope.
+
     Args:
       cell_fw: An instance of RNNCell, to be used for forward direction.
       cell_bw: An instance of RNNCell, to be used for backward direction.
@@ -505,6 +607,12 @@ def bidirectional_rnn(cell_fw, cell_bw, inputs,
       sequence_length: (optional) An int32/int64 vector, size `[batch_size]`,
         containing the actual lengths for each of the sequences.
       scope: VariableScope for the created subgraph; defaults to "BiRNN"
+      stack_directions: if True, run both directions as one recurrence whose
+        states are stacked on a leading axis, so each step does one batched
+        matmul instead of two small ones. The cells must support
+        `project_inputs` (e.g. a GRUCell, possibly wrapped). Variables are the
+        same as in the default mode; all steps are computed, with the state
+        carried through past each sequence's length.
 
     Returns:
       A tuple (outputs, output_state_fw, output_state_bw) where:
@@ -536,16 +644,22 @@ def bidirectional_rnn(cell_fw, cell_bw, inputs,
     else:
         raise TypeError("scope must be a string or an instance of VariableScope")
 
-    # Forward direction
-    with vs.variable_scope(name + "_FW") as fw_scope:
-        output_fw, output_state_fw = rnn(cell_fw, inputs, initial_state_fw, dtype,
-                                         sequence_length, scope=fw_scope)
-
-    # Backward direction
-    with vs.variable_scope(name + "_BW") as bw_scope:
+    if stack_directions:
         reversed_inputs = _reverse_seq(inputs, sequence_length)
-        tmp, output_state_bw = rnn(cell_bw, reversed_inputs, initial_state_bw,
-                                   dtype, sequence_length, scope=bw_scope)
+        output_fw, output_state_fw, tmp, output_state_bw = _stacked_directions_rnn(
+                cell_fw, cell_bw, inputs, reversed_inputs,
+                initial_state_fw, initial_state_bw, dtype, sequence_length, name)
+    else:
+        # Forward direction
+        with vs.variable_scope(name + "_FW") as fw_scope:
+            output_fw, output_state_fw = rnn(cell_fw, inputs, initial_state_fw, dtype,
+                                             sequence_length, scope=fw_scope)
+
+        # Backward direction
+        with vs.variable_scope(name + "_BW") as bw_scope:
+            reversed_inputs = _reverse_seq(inputs, sequence_length)
+            tmp, output_state_bw = rnn(cell_bw, reversed_inputs, initial_state_bw,
+                                       dtype, sequence_length, scope=bw_scope)
     output_bw = _reverse_seq(tmp, sequence_length)
     # Concat each of the forward/backward outputs
     flat_output_fw = nest.flatten(output_fw)
@@ -29,6 +29,7 @@
 ## Classes storing split `RNNCell` state
 
 @@LSTMStateTuple
+@@GRUProjection
 
 ## RNN Cell wrappers (RNNCells that wrap other RNNCells)
 
@@ -180,6 +181,38 @@ class RNNCell(object):
 
         return zeros
 
+    def project_inputs(self, inputs, context_size=0):
+        """Precompute the input-only part of the cell for a whole sequence.
+
+        Cells whose first layer is a linear map of `inputs` can apply it to all
+        timesteps in one large matmul, so that only the recurrent part is left
+        to run inside the unrolled loop (see `call_projected`).
+
+        Args:
+          inputs: a length T list of inputs, each a `2-D` tensor with shape
+            `[batch_size x input_size]`.
+          context_size: size of the `context` that will be given to
+            `call_projected` at every step, 0 if none.
+
+        Returns:
+          None if the cell has no such fast path (the default), otherwise a
+          length T list of per-step values to pass to `call_projected`.
+        """
+        return None
+
+    def call_projected(self, projection, state, context=None):
+        """Run this RNN cell on one step of the output of `project_inputs`.
+
+        Args:
+          projection: the element of `project_inputs` for the current step.
+          state: as in `__call__`.
+          context: optional `2-D` tensor fed to the cell along with the state.
+
+        Returns:
+          A pair (output, new state), as for `__call__`.
+        """
+        raise NotImplementedError("Abstract method")
+
 
 class BasicRNNCell(RNNCell):
     """The most basic RNN cell."""
@@ -246,6 +279,98 @@ class GRUCell(RNNCell):
             new_h = u * state + (1 - u) * c
         return new_h, new_h
 
+    def project_inputs(self, inputs, context_size=0, scope=None):
+        """Apply the input rows of the gate and candidate matrices to a sequence.
+
+        `__call__` multiplies `[inputs, state, context]` by one matrix per
+        layer, so the rows belonging to `inputs` can be split off and applied to
+        all timesteps at once: gates and candidate share a single
+        `[T * batch_size x input_size] x [input_size x 3 * num_units]` matmul.
+        The variables are the ones `__call__` creates, with the same names and
+        shapes, so both paths read the same checkpoints.
+
+        Args:
+          inputs: a length T list of `2-D` tensors `[batch_size x input_size]`.
+          context_size: size of the context given to `call_projected`, 0 if none.
+          scope: VariableScope for the created subgraph; defaults to class name.
+
+        Returns:
+          A length T list of `GRUProjection` tuples.
+
+        Raises:
+          ValueError: if the input size cannot be inferred from the inputs.
+        """
+        input_size = inputs[0].get_shape().with_rank(2)[1].value
+        if input_size is None:
+            raise ValueError("Could not infer input size from inputs.get_shape()[-1]")
+        dtype = inputs[0].dtype
+        total_arg_size = input_size + self._num_units + context_size
+        with vs.variable_scope(scope or type(self).__name__):  # "GRUCell"
+            with vs.variable_scope("Gates"):
+                gates_input, gates_matrix = _split_linear_matrix(
+                        input_size, total_arg_size, 2 * self._num_units, dtype,
+                        weight_initializer=self._weight_initializer)
+            with vs.variable_scope("Candidate"):
+                candidate_input, candidate_matrix = _split_linear_matrix(
+                        input_size, total_arg_size, self._num_units, dtype,
+                        weight_initializer=self._weight_initializer)
+            projected = math_ops.matmul(
+                    array_ops.concat(0, inputs),
+                    array_ops.concat(1, [gates_input, candidate_input]))
+            gates = array_ops.slice(projected, [0, 0], [-1, 2 * self._num_units])
+            candidate = array_ops.slice(projected, [0, 2 * self._num_units], [-1, -1])
+            if len(inputs) > 1:
+                gates = array_ops.split(0, len(inputs), gates)
+                candidate = array_ops.split(0, len(inputs), candidate)
+            else:
+                gates, candidate = [gates], [candidate]
+        return [GRUProjection(g, c, gates_matrix, candidate_matrix)
+                for g, c in zip(gates, candidate)]
+
+    def call_projected(self, projection, state, context=None):
+        """GRU step on inputs already multiplied by `project_inputs`.
+
+        Computes the same function as `__call__`, but only the recurrent rows
+        (those for `state` and `context`) are multiplied at this step.
+
+        The step also accepts several independent GRUs stacked on a leading
+        axis: `state` of shape `[k x batch_size x num_units]` and a projection
+        whose fields are packed the same way, with `[k x rows x cols]` matrices.
+        """
+        axis = state.get_shape().ndims - 1
+        matmul = math_ops.batch_matmul if axis == 2 else math_ops.matmul
+        if context is None:
+            gates = matmul(state, projection.gates_matrix)
+        else:
+            gates = matmul(array_ops.concat(axis, [state, context]),
+                           projection.gates_matrix)
+        r, u = array_ops.split(axis, 2, projection.gates + gates)
+        r, u = sigmoid(r), sigmoid(u)
+        if context is None:
+            c = matmul(r * state, projection.candidate_matrix)
+        else:
+            c = matmul(array_ops.concat(axis, [r * state, context]),
+                       projection.candidate_matrix)
+        c = self._activation(projection.candidate + c)
+        new_h = u * state + (1 - u) * c
+        return new_h, new_h
+
+
+_GRUProjection = collections.namedtuple(
+        "GRUProjection",
+        ("gates", "candidate", "gates_matrix", "candidate_matrix"))
+
+
+class GRUProjection(_GRUProjection):
+    """One step of `GRUCell.project_inputs`.
+
+    Stores four elements: `(gates, candidate, gates_matrix, candidate_matrix)`.
+    The first two are the input terms of the reset/update gates and of the
+    candidate at this step; the last two are the recurrent rows of the
+    corresponding weight matrices, shared by all steps of the sequence.
+    """
+    __slots__ = ()
+
 
 _LSTMStateTuple = collections.namedtuple("LSTMStateTuple", ("c", "h"))
 
@@ -700,6 +825,23 @@ class DropoutWrapper(RNNCell):
             output = nn_ops.dropout(output, self._output_keep_prob, seed=self._seed)
         return output, new_state
 
+    def project_inputs(self, inputs, context_size=0):
+        """Apply the input dropout, then let the wrapped cell project inputs."""
+        if (not isinstance(self._input_keep_prob, float) or
+                    self._input_keep_prob < 1):
+            # One dropout per step, as in __call__, so the masks are unchanged.
+            inputs = [nn_ops.dropout(inp, self._input_keep_prob, seed=self._seed)
+                      for inp in inputs]
+        return self._cell.project_inputs(inputs, context_size)
+
+    def call_projected(self, projection, state, context=None):
+        """Run the wrapped cell on a projected step with the output dropout."""
+        output, new_state = self._cell.call_projected(projection, state, context)
+        if (not isinstance(self._output_keep_prob, float) or
+                    self._output_keep_prob < 1):
+            output = nn_ops.dropout(output, self._output_keep_prob, seed=self._seed)
+        return output, new_state
+
 
 class EmbeddingWrapper(RNNCell):
     """Operator adding input embedding to the given cell.
@@ -707,7 +849,8 @@ class EmbeddingWrapper(RNNCell):
     Note: in many cases it may be more efficient to not use this wrapper,
     but instead concatenate the whole sequence of your inputs in time,
     do the embedding on this batch-concatenated sequence, then split it and
-    feed into your RNN.
+    feed into your RNN. `rnn.rnn` does exactly that through `project_inputs`
+    when the wrapped cell supports it.
     """
 
     def __init__(self, cell, embedding_classes, embedding_size,
@@ -777,6 +920,28 @@ class EmbeddingWrapper(RNNCell):
                 # end by yfeng
         return self._cell(embedded, state)
 
+    def project_inputs(self, inputs, context_size=0):
+        """Embed all steps of `inputs` in one lookup, then project them.
+
+        The T id vectors are concatenated time-major into a single
+        `[T * batch_size]` vector, looked up at once and split back into steps
+        for the wrapped cell, which can then apply its input weights to the
+        whole sequence in one matmul as well.
+        """
+        with vs.variable_scope(type(self).__name__):  # "EmbeddingWrapper"
+            with ops.device("/cpu:0"):
+                ids = array_ops.reshape(array_ops.concat(0, inputs), [-1])
+                embedded = embedding_ops.embedding_lookup(self._embedding, ids)
+        if len(inputs) > 1:
+            embedded = array_ops.split(0, len(inputs), embedded)
+        else:
+            embedded = [embedded]
+        return self._cell.project_inputs(embedded, context_size)
+
+    def call_projected(self, projection, state, context=None):
+        """Run the wrapped cell on one projected step."""
+        return self._cell.call_projected(projection, state, context)
+
 
 class MultiRNNCell(RNNCell):
     """RNN cell composed sequentially of multiple simple cells."""
@@ -957,6 +1122,30 @@ def orthogonal_initializer(shape=None, scale=1.0):
     return _initializer
 
 
+def _split_linear_matrix(input_size, total_arg_size, output_size, dtype,
+                         weight_initializer=None, scope=None):
+    """Get the `_linear2` matrix split into its input rows and the other rows.
+
+    Args:
+      input_size: int, number of leading rows that multiply the inputs.
+      total_arg_size: int, first dimension of the whole matrix.
+      output_size: int, second dimension of the matrix.
+      dtype: the data type of the matrix.
+      weight_initializer: as in `_linear2`.
+      scope: VariableScope for the created subgraph; defaults to "Linear".
+
+    Returns:
+      A pair of 2D Tensors with shapes [input_size x output_size] and
+      [(total_arg_size - input_size) x output_size].
+    """
+    with vs.variable_scope(scope or "Linear"):
+        matrix = vs.get_variable(
+                "Matrix", [total_arg_size, output_size], dtype=dtype,
+                initializer=weight_initializer)
+    return (array_ops.slice(matrix, [0, 0], [input_size, -1]),
+            array_ops.slice(matrix, [input_size, 0], [-1, -1]))
+
+
 # modified by yfeng to add the initializer
 def _linear2(args, output_size, bias, bias_start=0.0, weight_initializer=None, scope=None):
     """Linear map: sum_i(args[i] * W[i]), where W[i] is a variable.
@@ -114,17 +114,21 @@ def _extract_argmax_and_embed(embedding,
                     prev, output_projection[0], output_projection[1])
 
         # prev_symbol = math_ops.argmax(prev, 1) #annotated by shiyue
-        # added by shiyue
-        prev = math_ops.log(nn_ops.softmax(prev))
-        prev = nn_ops.bias_add(array_ops.transpose(prev), prev_probs)  # num_symbols*BEAM_SIZE
-        prev = array_ops.transpose(prev)
-        prev = array_ops.expand_dims(array_ops.reshape(prev, [-1]), 0)  # 1*(BEAM_SIZE*num_symbols)
-        probs, prev_symbolb = nn_ops.top_k(prev, beam_size)
-        probs = array_ops.squeeze(probs, [0])  # BEAM_SIZE,
-        prev_symbolb = array_ops.squeeze(prev_symbolb, [0])  # BEAM_SIZE,
-        index = prev_symbolb // num_symbols
-        prev_symbol = prev_symbolb % num_symbols
-        # ended by shiyue
+        # Rows are the BEAM_SIZE beams of each sentence, sentence by sentence.
+        # Scores of all extensions: (SENTENCES*BEAM_SIZE)*num_symbols.
+        prev = nn_ops.log_softmax(prev) + array_ops.expand_dims(prev_probs, 1)
+        # The best BEAM_SIZE of a sentence are among the best BEAM_SIZE of each
+        # of its beams, so its top_k only looks at BEAM_SIZE*BEAM_SIZE candidates.
+        beam_probs, beam_symbols = nn_ops.top_k(prev, beam_size)  # (SENTENCES*BEAM_SIZE)*BEAM_SIZE
+        probs, best = nn_ops.top_k(array_ops.reshape(beam_probs, [-1, beam_size * beam_size]),
+                                   beam_size)  # SENTENCES*BEAM_SIZE
+        # First row of each sentence.
+        offsets = array_ops.expand_dims(
+                math_ops.range(0, array_ops.shape(best)[0]) * beam_size, 1)
+        probs = array_ops.reshape(probs, [-1])
+        index = array_ops.reshape(best // beam_size + offsets, [-1])
+        prev_symbol = array_ops.gather(array_ops.reshape(beam_symbols, [-1]),
+                                       array_ops.reshape(best + offsets * beam_size, [-1]))
 
         # Note that gradients will not propagate through the second parameter of
         # embedding_lookup.
@@ -136,6 +140,18 @@ def _extract_argmax_and_embed(embedding,
     return loop_function
 
 
+def _tile_beams(tensor, beam_size):
+    """Repeat each row of tensor beam_size times, the copies of a row together."""
+    static_shape = tensor.get_shape()
+    shape = array_ops.shape(tensor)
+    multiples = array_ops.concat(0, [[1, beam_size], array_ops.ones_like(shape[1:])])
+    tiled = array_ops.tile(array_ops.expand_dims(tensor, 1), multiples)
+    tiled = array_ops.reshape(tiled, array_ops.concat(0, [[-1], shape[1:]]))
+    if static_shape.ndims is not None:
+        tiled.set_shape([None] + static_shape.as_list()[1:])
+    return tiled
+
+
 def attention_decoder(encoder_mask_1, encoder_mask_2, decoder_inputs, initial_state, 
                       attention_states_1, attention_states_2, cell,
                       beam_size,  # added by shiyue
@@ -209,6 +225,17 @@ def attention_decoder(encoder_mask_1, encoder_mask_2, decoder_inputs, initial_st
         output_size = cell.output_size
 
     with variable_scope.variable_scope(scope or "attention_decoder"):
+        if loop_function is not None:
+            # Beam search decodes a batch of sentences with beam_size rows per
+            # sentence, so the inputs of each sentence are repeated that often.
+            num_sentences = array_ops.shape(decoder_inputs[0])[0]
+            attention_states_1 = _tile_beams(attention_states_1, beam_size)
+            attention_states_2 = _tile_beams(attention_states_2, beam_size)
+            encoder_mask_1 = _tile_beams(encoder_mask_1, beam_size)
+            encoder_mask_2 = _tile_beams(encoder_mask_2, beam_size)
+            initial_state = _tile_beams(initial_state, beam_size)
+            # Only the first input (GO) is read; later ones come from loop_function.
+            decoder_inputs = [_tile_beams(decoder_inputs[0], beam_size)] + decoder_inputs[1:]
         batch_size = array_ops.shape(decoder_inputs[0])[0]  # Needed for reshaping.
         attn_length_1 = attention_states_1.get_shape()[1].value
         attn_length_2 = attention_states_2.get_shape()[1].value
@@ -297,10 +324,23 @@ def attention_decoder(encoder_mask_1, encoder_mask_2, decoder_inputs, initial_st
         # added by shiyue
         symbols = []
         aligns_1, aligns_2 = [], []
-        prev_probs = [0]
+        if loop_function is not None:
+            # All beams of a sentence start out equal; only the first one is
+            # extended at the first step.
+            first_beam = ops.convert_to_tensor([0.0] + [-1e30] * (beam_size - 1))
+            prev_probs = array_ops.reshape(
+                    array_ops.tile(array_ops.expand_dims(first_beam, 0),
+                                   array_ops.pack([num_sentences, 1])), [-1])
         # ended by shiyue
         batch_attn_size = array_ops.pack([batch_size, attn_size])
         attns = [] # added by al
+
+        # With the decoder inputs given up front, the input rows of the cell
+        # are applied to all steps in one matmul; beam search (loop_function)
+        # only knows each input at its own step.
+        projections = None
+        if loop_function is None:
+            projections = cell.project_inputs(decoder_inputs, context_size=attn_size)
         
         # annotated by al
         # attns = [array_ops.zeros(batch_attn_size, dtype=dtype)
@@ -349,7 +389,10 @@ def attention_decoder(encoder_mask_1, encoder_mask_2, decoder_inputs, initial_st
             # x = linear([inp] + attns, input_size, False,
             #            scope="cell_input")  # added by yfeng
             # Run the RNN.
-            state, _ = cell(inp, state, attns[0])
+            if projections is not None:
+                state, _ = cell.call_projected(projections[i], state, attns[0])
+            else:
+                state, _ = cell(inp, state, attns[0])
 
             with variable_scope.variable_scope("AttnOutputProjection"):
                 output = linear([state] + [inp] + attns, output_size, False)
@@ -371,12 +414,14 @@ def attention_decoder(encoder_mask_1, encoder_mask_2, decoder_inputs, initial_st
                 symbols[j] = array_ops.gather(symbol, index)  # update prev symbols
             symbols.append(prev_symbol)
 
-            # output the final best result of beam search
+            # output the final best result of beam search: the first beam of
+            # each sentence
+            best_rows = math_ops.range(0, num_sentences) * beam_size
             for k, symbol in enumerate(symbols):
-                symbols[k] = array_ops.gather(symbol, 0)
-            state = array_ops.expand_dims(array_ops.gather(state, 0), 0)
+                symbols[k] = array_ops.gather(symbol, best_rows)
+            state = array_ops.gather(state, best_rows)
             for j, output in enumerate(outputs):
-                outputs[j] = array_ops.expand_dims(array_ops.gather(output, 0), 0)  # update prev outputs
+                outputs[j] = array_ops.gather(output, best_rows)  # update prev outputs
                 # ended by shiyue
     return outputs, state, symbols  # modified by shiyue
 
@@ -481,6 +526,7 @@ def embedding_attention_seq2seq(encoder_inputs_1, encoder_inputs_2, encoder_mask
                                 num_heads=1, output_projection=None,
                                 feed_previous=False, dtype=dtypes.float32,
                                 scope=None,
+                                stack_directions=False,
                                 # initial_state_attention=False  #annotated by yfeng
                                 initial_state_attention=True  # added by yfeng
                                 ):
@@ -513,6 +559,9 @@ def embedding_attention_seq2seq(encoder_inputs_1, encoder_inputs_2, encoder_mask
       dtype: The dtype of the initial RNN state (default: tf.float32).
       scope: VariableScope for the created subgraph; defaults to
         "embedding_attention_seq2seq".
+      stack_directions: Boolean; if True, each bidirectional encoder runs its
+        forward and backward passes as one stacked recurrence (see
+        rnn.bidirectional_rnn). Variables are the same either way.
       initial_state_attention: If False (default), initial attentions are zero.
         If True, initialize the attentions from the initial state and attention
         states.
@@ -571,7 +620,8 @@ def embedding_attention_seq2seq(encoder_inputs_1, encoder_inputs_2, encoder_mask
                     cell, embedding_classes=num_encoder_symbols_1,
                     embedding_size=embedding_size, embedding=embedding_1)
             encoder_outputs_1, _, encoder_state_1 = rnn.bidirectional_rnn(
-                    encoder_cell_1, encoder_cell_1, encoder_inputs_1, sequence_length=encoder_lens_1, dtype=dtype)
+                    encoder_cell_1, encoder_cell_1, encoder_inputs_1, sequence_length=encoder_lens_1, dtype=dtype,
+                    stack_directions=stack_directions)
 
         
         with variable_scope.variable_scope("encoder_2"):
@@ -579,7 +629,8 @@ def embedding_attention_seq2seq(encoder_inputs_1, encoder_inputs_2, encoder_mask
                     cell, embedding_classes=num_encoder_symbols_2,
                     embedding_size=embedding_size, embedding=embedding_2)
             encoder_outputs_2, _, encoder_state_2 = rnn.bidirectional_rnn(
-                    encoder_cell_2, encoder_cell_2, encoder_inputs_2, sequence_length=encoder_lens_2, dtype=dtype)
+                    encoder_cell_2, encoder_cell_2, encoder_inputs_2, sequence_length=encoder_lens_2, dtype=dtype,
+                    stack_directions=stack_directions)
 
         encoder_state = alpha * encoder_state_1 + beta * encoder_state_2 # this can be changed
 
@@ -790,11 +841,11 @@ def model_with_buckets(encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encod
                 symbols.append(bucket_symbols)  # added by shiyue
                 if per_example_loss:
                     losses.append(sequence_loss_by_example(
-                            outputs[-1], targets[:bucket[1]], weights[:bucket[1]],
+                            outputs[-1], targets[:bucket[2]], weights[:bucket[2]],
                             softmax_loss_function=softmax_loss_function))
                 else:
                     losses.append(sequence_loss(
-                            outputs[-1], targets[:bucket[1]], weights[:bucket[1]],
+                            outputs[-1], targets[:bucket[2]], weights[:bucket[2]],
                             softmax_loss_function=softmax_loss_function))
 
     return outputs, losses, symbols  # modified by shiyue
@@ -19,11 +19,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+import collections
 import random
+import time
 
 import numpy as np
 from six.moves import xrange  # pylint: disable=redefined-builtin
 import tensorflow as tf
+from tensorflow.python.framework import graph_util
 from tensorflow.python.ops import nn_ops
 from tensorflow.python.ops import array_ops
 
@@ -34,6 +38,15 @@ import seq2seq_al
 
 SEED = 123
 
+# The feeds of one replica of the model.
+ReplicaInputs = collections.namedtuple(
+        "ReplicaInputs", ("encoder_inputs_1", "encoder_inputs_2", "encoder_mask_1",
+                          "encoder_mask_2", "decoder_inputs", "target_weights"))
+
+# Node names of a frozen model (see export_frozen_model).
+FROZEN_BUCKETS = "buckets"
+FROZEN_SYMBOLS = "bucket_%d_symbols"
+
 
 class Seq2SeqModel(object):
     """Sequence-to-sequence model with attention and for multiple buckets.
@@ -59,7 +72,9 @@ class Seq2SeqModel(object):
                  constant_emb_en, # added by al
                  constant_emb_fr, # added by al
                  use_lstm=False,
-                 num_samples=10240, forward_only=False):
+                 num_samples=10240, forward_only=False,
+                 stack_directions=False, replica_devices=None, accumulate_steps=1,
+                 lazy_buckets=False):
         """Create the model.
 
         Args:
@@ -83,16 +98,39 @@ class Seq2SeqModel(object):
           use_lstm: if true, we use LSTM cells instead of GRU cells.
           num_samples: number of samples for sampled softmax.
           forward_only: if set, we do not construct the backward pass in the model.
+          stack_directions: if set, each bidirectional encoder runs its two
+            directions as one stacked recurrence; checkpoints are unaffected.
+          replica_devices: for data-parallel training, one device (name or
+            function, e.g. from tf.train.replica_device_setter) per replica of
+            the model. The replicas share the variables, which are created on
+            the first device, and the update ops apply the average of their
+            gradients. See replicated_step.
+          accumulate_steps: if more than 1, a training step only adds its
+            clipped gradients to accumulators, and every accumulate_steps-th
+            step applies their average, emulating a batch that many times
+            larger without its memory.
+          lazy_buckets: if set and forward_only, only the first bucket is
+            built here, which creates all variables; the ops of every other
+            bucket are built the first time step runs it. Training models are
+            always built whole: training reaches every bucket at once, and
+            building them in the loop would only skew the step timings.
         """
         self.source_vocab_size_1 = source_vocab_size_1
         self.source_vocab_size_2 = source_vocab_size_2
         self.target_vocab_size = target_vocab_size
         self.buckets = buckets
         self.batch_size = batch_size
-        self.learning_rate = tf.Variable(float(learning_rate), trainable=False)
-        self.learning_rate_decay_op = self.learning_rate.assign(
-                self.learning_rate * learning_rate_decay_factor)
-        self.global_step = tf.Variable(0, trainable=False)
+        self.accumulate_steps = accumulate_steps
+        self._micro_steps = 0
+        # A profiling.Profiler that traces some of the training steps.
+        self.profiler = None
+        replica_devices = replica_devices or [None]
+        self.num_replicas = len(replica_devices)
+        with tf.device(replica_devices[0]):
+            self.learning_rate = tf.Variable(float(learning_rate), trainable=False)
+            self.learning_rate_decay_op = self.learning_rate.assign(
+                    self.learning_rate * learning_rate_decay_factor)
+            self.global_step = tf.Variable(0, trainable=False)
 
         # If we use sampled softmax, we need an output projection.
         output_projection = None
@@ -100,12 +138,13 @@ class Seq2SeqModel(object):
         # Sampled softmax only makes sense if we sample less than vocabulary size.
         # if num_samples > 0 and num_samples < self.target_vocab_size:
         if num_samples > 0:
-            # w = tf.get_variable("proj_w", [size, self.target_vocab_size])  #annotated by feng
-            w = tf.get_variable("proj_w", [hidden_units // 2, self.target_vocab_size],
-                                initializer=tf.random_normal_initializer(0, 0.01, seed=SEED))  # added by yfeng
-            # w_t = tf.transpose(w)
-            b = tf.get_variable("proj_b", [self.target_vocab_size],
-                                initializer=tf.constant_initializer(0.0), trainable=False)  # added by yfeng
+            with tf.device(replica_devices[0]):
+                # w = tf.get_variable("proj_w", [size, self.target_vocab_size])  #annotated by feng
+                w = tf.get_variable("proj_w", [hidden_units // 2, self.target_vocab_size],
+                                    initializer=tf.random_normal_initializer(0, 0.01, seed=SEED))  # added by yfeng
+                # w_t = tf.transpose(w)
+                b = tf.get_variable("proj_b", [self.target_vocab_size],
+                                    initializer=tf.constant_initializer(0.0), trainable=False)  # added by yfeng
             output_projection = (w, b)
 
             def sampled_loss(logit, target):
@@ -148,89 +187,178 @@ class Seq2SeqModel(object):
                     constant_emb_en=constant_emb_en, # added by al
                     constant_emb_fr=constant_emb_fr, # added by al
                     output_projection=output_projection,
-                    feed_previous=do_decode)
-
-        # Feeds for inputs.
-        self.encoder_inputs_1 = []
-        self.encoder_inputs_2 = []
-        self.decoder_inputs = []
-        self.target_weights = []
-        for i in xrange(buckets[-1][0]):  # Last bucket is the biggest one.
-            self.encoder_inputs_1.append(tf.placeholder(tf.int32, shape=[None],
-                                                      name="encoder{0}_1".format(i)))
-
-        for i in xrange(buckets[-1][1]):  # Last bucket is the biggest one.
-            self.encoder_inputs_2.append(tf.placeholder(tf.int32, shape=[None],
-                                                      name="encoder{0}_2".format(i)))
-
-        for i in xrange(buckets[-1][2] + 1):
-            self.decoder_inputs.append(tf.placeholder(tf.int32, shape=[None],
-                                                      name="decoder{0}".format(i)))
-            self.target_weights.append(tf.placeholder(tf.float32, shape=[None],
-                                                      name="weight{0}".format(i)))
-        self.encoder_mask_1 = tf.placeholder(tf.int32, shape=[None, None],
-                                           name="encoder_mask_1")
-        self.encoder_mask_2 = tf.placeholder(tf.int32, shape=[None, None],
-                                           name="encoder_mask_2")
-
-        # Our targets are decoder inputs shifted by one.
-        targets = [self.decoder_inputs[i + 1]
-                   for i in xrange(len(self.decoder_inputs) - 1)]
-
-        # Training outputs and losses.
-        if forward_only:
-            # self.outputs, self.losses = tf.nn.seq2seq.model_with_buckets( #annotated by yfeng
-            self.outputs, self.losses, self.symbols = seq2seq_al.model_with_buckets(  # added by yfeng and shiyue
-                    self.encoder_inputs_1, self.encoder_inputs_2,
-                    self.encoder_mask_1, self.encoder_mask_2,
-                    self.decoder_inputs, targets,
-                    self.target_weights, buckets, lambda x1, x2, y1, y2, z: seq2seq_f(x1, x2, y1, y2, z, True),
-                    softmax_loss_function=softmax_loss_function)
-            # If we use output projection, we need to project outputs for decoding.
-            # annotated by shiyue, when using beam search, no need to do decoding projection
-            # if output_projection is not None:
-            #     for b in xrange(len(buckets)):
-            #         self.outputs[b] = [
-            #             tf.matmul(output, output_projection[0]) + output_projection[1]
-            #             for output in self.outputs[b]
-            #             ]
-            # ended by shiyue
-        else:
-            # self.outputs, self.losses = tf.nn.seq2seq.model_with_buckets(  #annotated by yfeng
-            self.outputs, self.losses, self.symbols = seq2seq_al.model_with_buckets(  # added by yfeng and shiyue
-                    self.encoder_inputs_1, self.encoder_inputs_2,
-                    self.encoder_mask_1, self.encoder_mask_2,
-                    self.decoder_inputs, targets,
-                    self.target_weights, buckets,
-                    lambda x1, x2, y1, y2, z: seq2seq_f(x1, x2, y1, y2, z, False),
-                    softmax_loss_function=softmax_loss_function)
+                    feed_previous=do_decode,
+                    stack_directions=stack_directions)
+
+        self._seq2seq_f = seq2seq_f
+        self._softmax_loss_function = softmax_loss_function
+        self._forward_only = forward_only
+        self._replica_devices = replica_devices
+        self._max_gradient_norm = max_gradient_norm
+        self._graph = tf.get_default_graph()
+        self._variable_scope = tf.get_variable_scope()
+        self._variables_created = False
+        # The ops of each bucket, None until the bucket is built.
+        self.outputs = [None] * len(buckets)
+        self.losses = [None] * len(buckets)
+        self.symbols = [None] * len(buckets)
+        self.replica_losses = [[None] * len(buckets) for _ in replica_devices]
+
+        self.replicas = []
+        for r, device in enumerate(replica_devices):
+            # Replica 0 keeps the plain placeholder names (see FrozenSeq2SeqModel).
+            with tf.device(device), tf.name_scope("replica_%d" % r if r else None):
+                self.replicas.append(self._build_inputs(buckets))
+        (self.encoder_inputs_1, self.encoder_inputs_2, self.encoder_mask_1,
+         self.encoder_mask_2, self.decoder_inputs, self.target_weights) = self.replicas[0]
+
+        # The first bucket creates the variables, which the others share.
+        self._build_bucket_outputs(0)
 
         # Gradients and SGD update operation for training the model.
-        params_to_update = tf.trainable_variables()
+        self._params = tf.trainable_variables()
         if not forward_only:
-            self.gradient_norms = []
+            self.gradient_norms = [None] * len(buckets)
             self.gradient_norms_print = []
-            self.updates = []
+            self.updates = [None] * len(buckets)
             # opt = tf.train.AdadeltaOptimizer(learning_rate=self.learning_rate, rho=0.95, epsilon=1e-6)
-            opt = tf.train.AdamOptimizer(learning_rate=self.learning_rate)
+            self._opt = tf.train.AdamOptimizer(learning_rate=self.learning_rate)
             # opt = tf.train.GradientDescentOptimizer(self.learning_rate) #added by yfeng
-            for b in xrange(len(buckets)):
-                gradients = tf.gradients(self.losses[b], params_to_update,
-                                         aggregation_method=tf.AggregationMethod.EXPERIMENTAL_TREE)
-                # gradients_print = tf.gradients(self.losses[b], params_to_print)
-                clipped_gradients, norm = tf.clip_by_global_norm(gradients,
-                                                                 max_gradient_norm)
-                # _, norm_print = tf.clip_by_global_norm(gradients_print,
-                #                                                  max_gradient_norm)
-                self.gradient_norms.append(norm)
-                # self.gradient_norms_print.append(norm_print)
-                self.updates.append(opt.apply_gradients(
-                        zip(clipped_gradients, params_to_update), global_step=self.global_step))
+            if accumulate_steps > 1:
+                # Local variables, so that checkpoints do not contain them.
+                self._accumulators = []
+                with tf.name_scope("gradient_accumulators"):
+                    for param in self._params:
+                        with tf.device(param.device):
+                            self._accumulators.append(tf.Variable(
+                                    tf.zeros(param.get_shape(), dtype=param.dtype.base_dtype),
+                                    trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                                    name=param.op.name))
+                apply_op = self._opt.apply_gradients(
+                        [(accumulator / accumulate_steps, param)
+                         for accumulator, param in zip(self._accumulators, self._params)],
+                        global_step=self.global_step)
+                with tf.control_dependencies([apply_op]):
+                    self.apply_accumulated = tf.group(*[
+                            accumulator.assign(tf.zeros_like(accumulator))
+                            for accumulator in self._accumulators])
+            # Also creates the optimizer's variables, before the saver.
+            self._build_bucket_updates(0)
+        for b in xrange(1, 1 if lazy_buckets and forward_only else len(buckets)):
+            self._build_bucket(b)
 
         # self.saver = tf.train.Saver(tf.all_variables()) #annotated by yfeng
         self.saver = tf.train.Saver(tf.all_variables(), max_to_keep=1000,
                                     keep_checkpoint_every_n_hours=6)  # added by yfeng
 
+    def _build_inputs(self, buckets):
+        """Create the feeds of one replica, as ReplicaInputs."""
+        # Feeds for inputs.
+        encoder_inputs_1 = []
+        encoder_inputs_2 = []
+        decoder_inputs = []
+        target_weights = []
+        for i in xrange(buckets[-1][0]):  # Last bucket is the biggest one.
+            encoder_inputs_1.append(tf.placeholder(tf.int32, shape=[None],
+                                                   name="encoder{0}_1".format(i)))
+
+        for i in xrange(buckets[-1][1]):  # Last bucket is the biggest one.
+            encoder_inputs_2.append(tf.placeholder(tf.int32, shape=[None],
+                                                   name="encoder{0}_2".format(i)))
+
+        for i in xrange(buckets[-1][2] + 1):
+            decoder_inputs.append(tf.placeholder(tf.int32, shape=[None],
+                                                 name="decoder{0}".format(i)))
+            target_weights.append(tf.placeholder(tf.float32, shape=[None],
+                                                 name="weight{0}".format(i)))
+        encoder_mask_1 = tf.placeholder(tf.int32, shape=[None, None],
+                                        name="encoder_mask_1")
+        encoder_mask_2 = tf.placeholder(tf.int32, shape=[None, None],
+                                        name="encoder_mask_2")
+        return ReplicaInputs(encoder_inputs_1, encoder_inputs_2, encoder_mask_1,
+                             encoder_mask_2, decoder_inputs, target_weights)
+
+    def _build_bucket(self, bucket_id):
+        """Create the ops of a bucket unless they exist, sharing the variables."""
+        if self.losses[bucket_id] is not None:
+            return
+        with self._graph.as_default():
+            self._build_bucket_outputs(bucket_id)
+            if not self._forward_only:
+                self._build_bucket_updates(bucket_id)
+
+    def _build_bucket_outputs(self, bucket_id):
+        """Create the outputs, losses and symbols of a bucket in every replica."""
+        bucket = self.buckets[bucket_id]
+        for r, (device, inputs) in enumerate(zip(self._replica_devices, self.replicas)):
+            with tf.variable_scope(self._variable_scope,
+                                   reuse=True if self._variables_created else None):
+                with tf.device(device), tf.name_scope("replica_%d" % r if r else None):
+                    # Our targets are decoder inputs shifted by one.
+                    targets = [inputs.decoder_inputs[i + 1]
+                               for i in xrange(len(inputs.decoder_inputs) - 1)]
+                    outputs, losses, symbols = seq2seq_al.model_with_buckets(  # added by yfeng and shiyue
+                            inputs.encoder_inputs_1, inputs.encoder_inputs_2,
+                            inputs.encoder_mask_1, inputs.encoder_mask_2,
+                            inputs.decoder_inputs, targets,
+                            inputs.target_weights, [bucket],
+                            lambda x1, x2, y1, y2, z: self._seq2seq_f(x1, x2, y1, y2, z,
+                                                                      self._forward_only),
+                            softmax_loss_function=self._softmax_loss_function)
+            self._variables_created = True
+            self.replica_losses[r][bucket_id] = losses[0]
+            if r == 0:
+                self.outputs[bucket_id] = outputs[0]
+                self.losses[bucket_id] = losses[0]
+                self.symbols[bucket_id] = symbols[0]
+
+    def _build_bucket_updates(self, bucket_id):
+        """Create the gradient norm and the update op of a bucket."""
+        replica_gradients = []
+        for device, losses in zip(self._replica_devices, self.replica_losses):
+            with tf.device(device):
+                replica_gradients.append(tf.gradients(
+                        losses[bucket_id], self._params,
+                        aggregation_method=tf.AggregationMethod.EXPERIMENTAL_TREE))
+        with tf.device(self._replica_devices[0]):
+            gradients = _average_gradients(replica_gradients)
+            # gradients_print = tf.gradients(self.losses[b], params_to_print)
+            clipped_gradients, norm = tf.clip_by_global_norm(gradients,
+                                                             self._max_gradient_norm)
+        # _, norm_print = tf.clip_by_global_norm(gradients_print,
+        #                                                  max_gradient_norm)
+        self.gradient_norms[bucket_id] = norm
+        # self.gradient_norms_print.append(norm_print)
+        if self.accumulate_steps > 1:
+            self.updates[bucket_id] = tf.group(*[
+                    accumulator.assign_add(gradient)
+                    for accumulator, gradient in zip(self._accumulators, clipped_gradients)
+                    if gradient is not None])
+        else:
+            self.updates[bucket_id] = self._opt.apply_gradients(
+                    zip(clipped_gradients, self._params), global_step=self.global_step)
+
+    def load_weights(self, session, weights):
+        """Assign numpy values to the model variables of the same name.
+
+        Args:
+          session: tensorflow session to use.
+          weights: a dict from variable name (e.g. "proj_w") to numpy array, as
+            returned by checkpoint_utils.load_weights. Entries that are not
+            variables of the model are ignored.
+
+        Raises:
+          ValueError: if a trainable variable of the model is not in weights.
+        """
+        missing = [v.op.name for v in tf.trainable_variables()
+                   if v.op.name not in weights]
+        if missing:
+            raise ValueError("Weights for %s not found." % ", ".join(missing))
+        for v in tf.all_variables():
+            if v.op.name in weights:
+                value = tf.placeholder(v.dtype.base_dtype, v.get_shape())
+                session.run(v.assign(value), {value: weights[v.op.name]})
+
     def step(self, session, encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs, target_weights,
              bucket_id, forward_only):
         """Run a step of the model feeding the given inputs.
@@ -249,8 +377,13 @@ class Seq2SeqModel(object):
 
         Raises:
           ValueError: if length of encoder_inputs, decoder_inputs, or
-            target_weights disagrees with bucket size for the specified bucket_id.
+            target_weights disagrees with bucket size for the specified bucket_id,
+            or if a replicated model is trained with step.
         """
+        if not forward_only and self.num_replicas > 1:
+            raise ValueError("Train a replicated model with replicated_step.")
+        self._build_bucket(bucket_id)
+        start_time = time.time()
         # Check if the sizes match.
         encoder_size_1, encoder_size_2, decoder_size = self.buckets[bucket_id]
         if len(encoder_inputs_1) != encoder_size_1:
@@ -268,19 +401,9 @@ class Seq2SeqModel(object):
 
         # Input feed: encoder inputs, decoder inputs, target_weights, as provided.
         input_feed = {}
-        for l in xrange(encoder_size_1):
-            input_feed[self.encoder_inputs_1[l].name] = encoder_inputs_1[l]
-        for l in xrange(encoder_size_2):
-            input_feed[self.encoder_inputs_2[l].name] = encoder_inputs_2[l]
-        for l in xrange(decoder_size):
-            input_feed[self.decoder_inputs[l].name] = decoder_inputs[l]
-            input_feed[self.target_weights[l].name] = target_weights[l]
-        input_feed[self.encoder_mask_1.name] = encoder_mask_1
-        input_feed[self.encoder_mask_2.name] = encoder_mask_2
-
-        # Since our targets are decoder inputs shifted by one, we need one more.
-        last_target = self.decoder_inputs[decoder_size].name
-        input_feed[last_target] = np.zeros([self.batch_size], dtype=np.int32)
+        self._add_input_feed(input_feed, self.replicas[0], bucket_id,
+                             (encoder_inputs_1, encoder_inputs_2, encoder_mask_1,
+                              encoder_mask_2, decoder_inputs, target_weights))
 
         # Output feed: depends on whether we do a backward step or not.
         if not forward_only:
@@ -290,21 +413,80 @@ class Seq2SeqModel(object):
         else:
             output_feed = [self.losses[bucket_id]]  # Loss for this batch.
             # modified by shiyue
-            if self.symbols[0]:
+            if self.symbols[bucket_id]:
                 for l in xrange(decoder_size):  # Output symbols
                     output_feed.append(self.symbols[bucket_id][l])
             else:
                 for l in xrange(decoder_size):  # Output logits.
                     output_feed.append(self.outputs[bucket_id][l])
 
-        outputs = session.run(output_feed, input_feed)
+        if forward_only:
+            outputs = session.run(output_feed, input_feed)
+        else:
+            outputs = self._run(session, output_feed, input_feed, bucket_id, start_time)
         if not forward_only:
+            self._end_training_step(session)
             return outputs[1], outputs[2], None  # Gradient norm, loss, no outputs.
         else:
             return None, outputs[0], outputs[1:]  # No gradient norm, loss, outputs.
 
-    def get_batch(self, data, bucket_id):
-        """Get a random batch of data from the specified bucket, prepare for step.
+    def _add_input_feed(self, input_feed, replica, bucket_id, batch):
+        """Add the feeds of a batch from get_batch for one replica to input_feed."""
+        encoder_size_1, encoder_size_2, decoder_size = self.buckets[bucket_id]
+        encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs, target_weights = batch
+        for l in xrange(encoder_size_1):
+            input_feed[replica.encoder_inputs_1[l].name] = encoder_inputs_1[l]
+        for l in xrange(encoder_size_2):
+            input_feed[replica.encoder_inputs_2[l].name] = encoder_inputs_2[l]
+        for l in xrange(decoder_size):
+            input_feed[replica.decoder_inputs[l].name] = decoder_inputs[l]
+            input_feed[replica.target_weights[l].name] = target_weights[l]
+        input_feed[replica.encoder_mask_1.name] = encoder_mask_1
+        input_feed[replica.encoder_mask_2.name] = encoder_mask_2
+
+        # Since our targets are decoder inputs shifted by one, we need one more.
+        last_target = replica.decoder_inputs[decoder_size].name
+        input_feed[last_target] = np.zeros([len(encoder_mask_1)], dtype=np.int32)
+
+    def replicated_step(self, session, batches, bucket_id):
+        """Run a training step on every replica and apply the averaged gradients.
+
+        Args:
+          session: tensorflow session to use.
+          batches: one batch per replica, each as returned by get_batch for
+            bucket_id.
+          bucket_id: which bucket of the model to use.
+
+        Returns:
+          A pair of the gradient norm and the average loss of the replicas.
+        """
+        self._build_bucket(bucket_id)
+        start_time = time.time()
+        input_feed = {}
+        for replica, batch in zip(self.replicas, batches):
+            self._add_input_feed(input_feed, replica, bucket_id, batch)
+        output_feed = [self.updates[bucket_id], self.gradient_norms[bucket_id]]
+        output_feed.extend(losses[bucket_id] for losses in self.replica_losses)
+        outputs = self._run(session, output_feed, input_feed, bucket_id, start_time)
+        self._end_training_step(session)
+        return outputs[1], sum(outputs[2:]) / len(self.replicas)
+
+    def _run(self, session, output_feed, input_feed, bucket_id, start_time):
+        """session.run of a training step, traced if the profiler samples it."""
+        if self.profiler is None or not self.profiler.should_trace():
+            return session.run(output_feed, input_feed)
+        self.profiler.add_python_time("feed", time.time() - start_time)
+        return self.profiler.run(session, output_feed, input_feed, "bucket%d" % bucket_id)
+
+    def _end_training_step(self, session):
+        """Apply the accumulated gradients once every accumulate_steps steps."""
+        if self.accumulate_steps > 1:
+            self._micro_steps += 1
+            if self._micro_steps % self.accumulate_steps == 0:
+                session.run(self.apply_accumulated)
+
+    def get_batch(self, data, bucket_id, indices=None):
+        """Get a batch of data from the specified bucket, prepare for step.
 
         To feed data in step(..) it must be a list of batch-major vectors, while
         data here contains single length-major cases. So the main logic of this
@@ -314,6 +496,9 @@ class Seq2SeqModel(object):
           data: a tuple of size len(self.buckets) in which each element contains
             lists of pairs of input and output data that we use to create a batch.
           bucket_id: integer, which bucket to get the batch for.
+          indices: the batch_size examples of data[bucket_id] to batch, e.g.
+            from data_iterator.EpochIterator; by default they are drawn at
+            random.
 
         Returns:
           The triple (encoder_inputs, decoder_inputs, target_weights) for
@@ -325,8 +510,11 @@ class Seq2SeqModel(object):
 
         # Get a random batch of encoder and decoder inputs from data,
         # pad them if needed, reverse encoder inputs and add GO to decoder.
-        for _ in xrange(self.batch_size):
-            encoder_input_1, encoder_input_2, decoder_input = random.choice(data[bucket_id])
+        if indices is None:
+            examples = [random.choice(data[bucket_id]) for _ in xrange(self.batch_size)]
+        else:
+            examples = [data[bucket_id][i] for i in indices]
+        for encoder_input_1, encoder_input_2, decoder_input in examples:
 
             # Encoder inputs are padded and then reversed.
             encoder_pad_1 = [data_utils.PAD_ID] * (encoder_size_1 - len(encoder_input_1))
@@ -370,3 +558,100 @@ class Seq2SeqModel(object):
                     batch_weight[batch_idx] = 0.0
             batch_weights.append(batch_weight)
         return batch_encoder_inputs_1, batch_encoder_inputs_2, encoder_mask_1, encoder_mask_2, batch_decoder_inputs, batch_weights
+
+
+def _average_gradients(replica_gradients):
+    """The element-wise average of the gradient lists of several replicas."""
+    if len(replica_gradients) == 1:
+        return replica_gradients[0]
+    averaged = []
+    for gradients in zip(*replica_gradients):
+        if gradients[0] is None:
+            averaged.append(None)
+        else:
+            averaged.append(tf.add_n([tf.convert_to_tensor(g) for g in gradients]) /
+                            len(gradients))
+    return averaged
+
+
+def export_frozen_model(session, model, path):
+    """Write the beam search of every bucket of model as a frozen GraphDef.
+
+    Only the ops needed for the decoded symbols are kept: no losses, no
+    optimizer state, and the variables become constants with their values in
+    session. The output of bucket b is named FROZEN_SYMBOLS % b and holds the
+    decoder_size x batch symbols of the best beam of each sentence; the bucket
+    sizes are stored in the constant FROZEN_BUCKETS.
+
+    Constant subgraphs are not folded in the file. The session that imports
+    the graph folds them on its first run, through TensorFlow's graph
+    optimizer at the default level (OptimizerOptions.L1, constant folding).
+
+    Args:
+      session: tensorflow session holding the values of the variables.
+      model: a Seq2SeqModel built with forward_only=True and beam search.
+      path: the file to write.
+    """
+    for b in xrange(len(model.buckets)):
+        model._build_bucket(b)  # pylint: disable=protected-access
+    output_names = [tf.constant(model.buckets, dtype=tf.int32,
+                                name=FROZEN_BUCKETS).op.name]
+    for b, (_, _, decoder_size) in enumerate(model.buckets):
+        symbols = tf.pack(model.symbols[b][:decoder_size], name=FROZEN_SYMBOLS % b)
+        output_names.append(symbols.op.name)
+    graph_def = graph_util.convert_variables_to_constants(
+            session, session.graph.as_graph_def(), output_names)
+    tf.train.write_graph(graph_def, os.path.dirname(path) or ".",
+                         os.path.basename(path), as_text=False)
+
+
+class FrozenSeq2SeqModel(Seq2SeqModel):
+    """Beam-search decoding from a graph written by export_frozen_model.
+
+    The graph is imported into the default graph and nothing else is built,
+    so only get_batch and a forward-only step are available.
+    """
+
+    def __init__(self, session, path, batch_size=1):
+        """Load the frozen model.
+
+        Args:
+          session: tensorflow session whose graph is the default graph.
+          path: the file written by export_frozen_model.
+          batch_size: the size of the batches fed to step.
+        """
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(path, "rb") as f:
+            graph_def.ParseFromString(f.read())
+        tf.import_graph_def(graph_def, name="")
+        self.buckets = [tuple(bucket) for bucket in
+                        session.run(FROZEN_BUCKETS + ":0").tolist()]
+        self.batch_size = batch_size
+
+    def step(self, session, encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs, target_weights,
+             bucket_id, forward_only=True):
+        """Decode a batch; the arguments are those of Seq2SeqModel.step.
+
+        Only the first decoder input (the GO symbols) is fed and the target
+        weights are ignored.
+
+        Returns:
+          A triple (None, None, symbols) where symbols are the decoder_size
+          output steps, each holding the symbol of the best beam of every
+          sentence of the batch.
+
+        Raises:
+          ValueError: if forward_only is not set.
+        """
+        if not forward_only:
+            raise ValueError("A frozen model can only be run forward.")
+        input_feed = {}
+        for l, encoder_input in enumerate(encoder_inputs_1):
+            input_feed["encoder{0}_1:0".format(l)] = encoder_input
+        for l, encoder_input in enumerate(encoder_inputs_2):
+            input_feed["encoder{0}_2:0".format(l)] = encoder_input
+        input_feed["decoder0:0"] = decoder_inputs[0]
+        input_feed["encoder_mask_1:0"] = encoder_mask_1
+        input_feed["encoder_mask_2:0"] = encoder_mask_2
+        symbols = session.run(FROZEN_SYMBOLS % bucket_id + ":0", input_feed)
+        return None, None, list(symbols)
@@ -0,0 +1,8 @@
+num=${1:-6000}
+python quantize.py --model translate.ckpt-${num}
+python translate.py --decode --model translate.ckpt-${num} < ../data_iwslt/test.en > res${num}
+python translate.py --decode --weights translate.ckpt-${num}.int8.npz < ../data_iwslt/test.en > res${num}.int8
+echo "After \"${num}\" updates, the float32 BLEU is:"
+perl multi-bleu.perl ../data_iwslt/devtest/devset3.lc.en < res${num}
+echo "and the int8 BLEU is:"
+perl multi-bleu.perl ../data_iwslt/devtest/devset3.lc.en < res${num}.int8
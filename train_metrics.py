@@ -0,0 +1,129 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Throughput metrics of a training run, written as JSON lines.
+
+Every training step is recorded with its bucket, the time spent building its
+batches and the time of the step itself. At each checkpoint the steps since
+the previous one are summarized into one line of the metrics file:
+
+  {"global_step": 6000, "steps": 250, "source_tokens_per_sec": ...,
+   "target_tokens_per_sec": ..., "source_padding": 0.21,
+   "target_padding": 0.34, "batch_wait_ms": 3.1,
+   "buckets": {"0": {"steps": 40, "step_ms_p50": ..., ...}, ...}}
+
+Tokens are the positions that are not padding: ones in the encoder masks and
+non-zero target weights. The padding shares are the other positions of the
+batches, out of all positions fed. Tokens per second are over the time of the
+steps and their batches, leaving out checkpoints and dev evaluation.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+
+import numpy as np
+
+PERCENTILES = [50, 90, 99]
+
+
+def batch_tokens(batch):
+    """Count the positions of a batch from Seq2SeqModel.get_batch.
+
+    Returns:
+      The tuple (source_tokens, source_positions, target_tokens,
+      target_positions); the source counts add up both encoders.
+    """
+    _, _, encoder_mask_1, encoder_mask_2, _, target_weights = batch
+    source_tokens = int(np.sum(encoder_mask_1)) + int(np.sum(encoder_mask_2))
+    source_positions = int(np.size(encoder_mask_1)) + int(np.size(encoder_mask_2))
+    target_tokens = int(np.count_nonzero(target_weights))
+    target_positions = int(np.size(target_weights))
+    return source_tokens, source_positions, target_tokens, target_positions
+
+
+class _BucketStats(object):
+
+    def __init__(self):
+        self.step_seconds = []
+        self.counts = np.zeros(4, dtype=np.int64)
+
+
+class ThroughputMetrics(object):
+    """Collects per-step timings and token counts and writes their summaries."""
+
+    def __init__(self, path):
+        """Create the metrics, appending to the JSON lines file at path."""
+        self.path = path
+        self._reset()
+
+    def _reset(self):
+        self._buckets = collections.defaultdict(_BucketStats)
+        self._batch_seconds = 0.0
+        self._steps = 0
+
+    def add_step(self, bucket_id, batches, batch_seconds, step_seconds):
+        """Record a training step.
+
+        Args:
+          bucket_id: the bucket of the step.
+          batches: the batches of the step (one per replica), as returned by
+            Seq2SeqModel.get_batch.
+          batch_seconds: time spent waiting for the batches to be built.
+          step_seconds: time of the step itself.
+        """
+        stats = self._buckets[bucket_id]
+        stats.step_seconds.append(step_seconds)
+        for batch in batches:
+            stats.counts += batch_tokens(batch)
+        self._batch_seconds += batch_seconds
+        self._steps += 1
+
+    def summary(self, global_step):
+        """The summary of the steps recorded since the last write, as a dict."""
+        elapsed = max(self._batch_seconds + sum(
+                sum(stats.step_seconds) for stats in self._buckets.values()), 1e-9)
+        source_tokens, source_positions, target_tokens, target_positions = sum(
+                (stats.counts for stats in self._buckets.values()), np.zeros(4, dtype=np.int64))
+        record = collections.OrderedDict()
+        record["global_step"] = int(global_step)
+        record["steps"] = self._steps
+        record["source_tokens_per_sec"] = source_tokens / elapsed
+        record["target_tokens_per_sec"] = target_tokens / elapsed
+        record["source_padding"] = 1.0 - source_tokens / max(source_positions, 1)
+        record["target_padding"] = 1.0 - target_tokens / max(target_positions, 1)
+        record["batch_wait_ms"] = 1000.0 * self._batch_seconds / max(self._steps, 1)
+        buckets = collections.OrderedDict()
+        for bucket_id in sorted(self._buckets):
+            stats = self._buckets[bucket_id]
+            bucket = collections.OrderedDict()
+            bucket["steps"] = len(stats.step_seconds)
+            for p, value in zip(PERCENTILES, np.percentile(stats.step_seconds, PERCENTILES)):
+                bucket["step_ms_p%d" % p] = 1000.0 * value
+            bucket["source_padding"] = 1.0 - stats.counts[0] / max(stats.counts[1], 1)
+            bucket["target_padding"] = 1.0 - stats.counts[2] / max(stats.counts[3], 1)
+            buckets[str(bucket_id)] = bucket
+        record["buckets"] = buckets
+        return record
+
+    def write(self, global_step):
+        """Append the summary to the metrics file, start a new period, return it."""
+        record = self.summary(global_step)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        self._reset()
+        return record
@@ -0,0 +1,21 @@
+# Data-parallel training on this machine: one parameter server and N workers,
+# each worker holding a replica of the model. Usage: sh train_parallel.sh [N]
+# Extra translate.py flags can be passed after N.
+num_workers=${1:-4}
+[ $# -gt 0 ] && shift
+port=2222
+ps_hosts=localhost:${port}
+worker_hosts=""
+for i in $(seq 0 $((num_workers - 1))); do
+    worker_hosts=${worker_hosts:+${worker_hosts},}localhost:$((port + 1 + i))
+done
+
+pids=""
+python translate.py --ps_hosts=${ps_hosts} --worker_hosts=${worker_hosts} --job_name=ps --task_index=0 "$@" &
+pids="${pids} $!"
+for i in $(seq 1 $((num_workers - 1))); do
+    python translate.py --ps_hosts=${ps_hosts} --worker_hosts=${worker_hosts} --job_name=worker --task_index=${i} "$@" &
+    pids="${pids} $!"
+done
+trap "kill ${pids}" EXIT
+python translate.py --ps_hosts=${ps_hosts} --worker_hosts=${worker_hosts} --job_name=worker --task_index=0 "$@"
@@ -31,6 +31,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import glob
+import itertools
 import math
 import os
 import random
@@ -44,8 +47,16 @@ import tensorflow as tf
 
 # from tensorflow.models.rnn.translate import data_utils    #annotated by yfeng
 # from tensorflow.models.rnn.translate import seq2seq_model   #annotated by yfeng
+import checkpoint_saver
+import bucketing
+import checkpoint_utils
+import data_iterator
+import pair_reader
+import profiling
+import train_metrics
 import data_utils  # added by yfeng
 import seq2seq_model  # added by yfeng
+import translation_cache
 
 tf.app.flags.DEFINE_float("learning_rate", 0.001, "Learning rate.")
 tf.app.flags.DEFINE_float("learning_rate_decay_factor", 0.99,
@@ -64,19 +75,97 @@ tf.app.flags.DEFINE_integer("en_vocab_size_2", 10000, "Pre-trained English vocab
 tf.app.flags.DEFINE_integer("fr_vocab_size", 10000, "English vocabulary size.")
 tf.app.flags.DEFINE_string("data_dir", "../data_iwslt", "Data directory")
 tf.app.flags.DEFINE_string("train_dir", "../train_iwslt", "Training directory.")
+tf.app.flags.DEFINE_string("buckets", "",
+                           "Bucket sizes as source,draft,target triples separated by '/', "
+                           "e.g. from bucketing.py (default: _buckets).")
 tf.app.flags.DEFINE_integer("max_train_data_size", 0,
                             "Limit on the size of training data (0: no limit).")
 tf.app.flags.DEFINE_integer("steps_per_checkpoint", 250,
                             "How many training steps to do per checkpoint.")
+tf.app.flags.DEFINE_string("metrics_file", "",
+                           "JSON lines file in train_dir for throughput metrics, "
+                           "e.g. metrics.jsonl (empty: off).")
+tf.app.flags.DEFINE_integer("profile_every_n_steps", 0,
+                            "Trace every n-th training step and report op time by scope (0: off).")
+tf.app.flags.DEFINE_string("profile_dir", "",
+                           "Directory for the traces and the scope table (default: train_dir/profile).")
+tf.app.flags.DEFINE_integer("accumulate_steps", 1,
+                            "Apply the averaged gradients of this many batches at once; "
+                            "must divide --steps_per_checkpoint.")
+tf.app.flags.DEFINE_boolean("lazy_buckets", True,
+                            "Build the graph of a bucket the first time it is decoded "
+                            "(training models are always built whole).")
+tf.app.flags.DEFINE_boolean("async_checkpoint", False,
+                            "Write checkpoints from a background thread.")
+tf.app.flags.DEFINE_boolean("dev_eval", True,
+                            "Evaluate on the dev set after each checkpoint; turn off "
+                            "when a separate --eval_worker does it.")
+tf.app.flags.DEFINE_boolean("eval_worker", False,
+                            "Evaluate each new checkpoint of train_dir on the dev set.")
+tf.app.flags.DEFINE_integer("eval_interval_secs", 60,
+                            "How often the eval worker looks for new checkpoints.")
+tf.app.flags.DEFINE_integer("keep_best", 0,
+                            "Keep the checkpoints with the best dev perplexity (0: no pruning).")
+tf.app.flags.DEFINE_integer("keep_last", 0,
+                            "Keep the newest checkpoints (0: no pruning).")
+tf.app.flags.DEFINE_integer("keep_every_n_steps", 0,
+                            "Keep the checkpoints at multiples of this step (0: no pruning).")
+tf.app.flags.DEFINE_boolean("weights_copies", False,
+                            "Write a weights file next to each checkpoint before pruning.")
+tf.app.flags.DEFINE_integer("keep_weights_copies", 10,
+                            "Weights files of pruned checkpoints to keep, the newest "
+                            "(0: delete them with their checkpoints).")
+tf.app.flags.DEFINE_integer("intra_op_threads", 0,
+                            "Threads used inside an op such as a matmul (0: one per core).")
+tf.app.flags.DEFINE_integer("inter_op_threads", 0,
+                            "Threads running independent ops concurrently (0: one per core).")
+tf.app.flags.DEFINE_string("ps_hosts", "",
+                           "Comma-separated host:port pairs of the parameter servers.")
+tf.app.flags.DEFINE_string("worker_hosts", "",
+                           "Comma-separated host:port pairs of the workers; when set, the model "
+                           "is trained data-parallel with one replica per worker.")
+tf.app.flags.DEFINE_string("job_name", "worker", "Cluster job of this process: ps or worker.")
+tf.app.flags.DEFINE_integer("task_index", 0,
+                            "Task of this process in its job; worker 0 drives the training.")
 tf.app.flags.DEFINE_boolean("decode", False,
                             "Set to True for interactive decoding.")
 tf.app.flags.DEFINE_boolean("self_test", False,
                             "Run a self-test if this is set to True.")
 # added by yfeng, for decode
 tf.app.flags.DEFINE_string("model", "ckpt", "the checkpoint model to load")
+tf.app.flags.DEFINE_string("weights", "",
+                           "weights file (e.g. from quantize.py) to load instead of a checkpoint; "
+                           "int8 weights are dequantized to float32 (numpy_engine.py "
+                           "computes with them in int8)")
+tf.app.flags.DEFINE_boolean("export", False,
+                            "Write the model as a frozen inference graph to --frozen_model.")
+tf.app.flags.DEFINE_string("frozen_model", "",
+                           "frozen inference graph to write with --export (default "
+                           "<model>.frozen.pb) or to decode with")
+tf.app.flags.DEFINE_string("input_format", "lines",
+                           "Decoding input: 'lines' (source and draft on consecutive lines), "
+                           "'tsv' (source<TAB>draft) or 'files' (see --input_files).")
+tf.app.flags.DEFINE_string("input_files", "",
+                           "Comma-separated parallel source and draft files for --input_format=files.")
+tf.app.flags.DEFINE_integer("read_ahead", 1000,
+                            "Input pairs read and tokenized ahead of the decoder.")
+tf.app.flags.DEFINE_integer("cache_entries", 0,
+                            "Translations kept in the decoding cache (0: no limit by count).")
+tf.app.flags.DEFINE_integer("cache_bytes", 0,
+                            "Approximate bytes kept in the decoding cache (0: no limit by size).")
+tf.app.flags.DEFINE_string("cache_file", "",
+                           "File the decoding cache is loaded from and saved to. The cache is "
+                           "used when this or one of its limits is set.")
+tf.app.flags.DEFINE_integer("decode_batch_size", 1,
+                            "Sentence pairs decoded together; above 1, the input is read in "
+                            "windows and sorted by length into batches.")
+tf.app.flags.DEFINE_integer("decode_window", 10000,
+                            "Sentence pairs read and sorted at a time with --decode_batch_size.")
 # added by shiyue, for beam search
 tf.app.flags.DEFINE_integer("beam_size", 5,
                             "The size of beam search. Do greedy search when set this to 1.")
+tf.app.flags.DEFINE_boolean("stack_directions", False,
+                            "Run the forward and backward encoder passes as one stacked recurrence.")
 # added by al, for constant embedding
 tf.app.flags.DEFINE_string("constant_emb_en_dir", "emb_en", "constant embedding directory")
 tf.app.flags.DEFINE_string("constant_emb_fr_dir", "emb_fr", "constant embedding directory")
@@ -87,6 +176,7 @@ tf.set_random_seed(123)
 
 # We use a number of buckets and pad to the closest one for efficiency.
 # See seq2seq_model.Seq2SeqModel for details of how they work.
+# --buckets (see bucketing.py) replaces them for a corpus.
 #_buckets = [(10, 10), (20, 20), (30, 30), (40, 40), (51, 51)]
 
 
@@ -94,6 +184,12 @@ tf.set_random_seed(123)
 _buckets = [(5, 10, 10), (10, 15, 15), (20, 25, 25), (45, 50, 50)] # added by al
 
 
+def session_config():
+    """The session configuration given by the thread flags."""
+    return tf.ConfigProto(intra_op_parallelism_threads=FLAGS.intra_op_threads,
+                          inter_op_parallelism_threads=FLAGS.inter_op_threads)
+
+
 def read_data(source_path_1, source_path_2, target_path, max_size=None):
     """Read data from source and target files and put into buckets.
 
@@ -160,7 +256,8 @@ def create_model(session, forward_only):
 # start by yfeng
 def create_model(session,
                  forward_only,
-                 ckpt_file=None):
+                 ckpt_file=None,
+                 replica_devices=None):
     """Create translation model and initialize or load parameters in session."""
     emb_en_file = file(FLAGS.constant_emb_en_dir, "rb")
     emb_fr_file = file(FLAGS.constant_emb_fr_dir, "rb")
@@ -174,13 +271,24 @@ def create_model(session,
             FLAGS.beam_size,  # added by shiyue
             constant_emb_en=constant_emb_en, # added by al
             constant_emb_fr=constant_emb_fr, # added by al
-            forward_only=forward_only)
-    if ckpt_file:
+            forward_only=forward_only,
+            stack_directions=FLAGS.stack_directions,
+            replica_devices=replica_devices,
+            accumulate_steps=FLAGS.accumulate_steps,
+            lazy_buckets=FLAGS.lazy_buckets)
+    if FLAGS.weights:
+        weights_path = os.path.join(FLAGS.train_dir, FLAGS.weights)
+        sys.stderr.write("Reading model weights from %s\n" % weights_path)
+        sys.stderr.flush()
+        session.run(tf.initialize_all_variables())
+        model.load_weights(session, checkpoint_utils.load_weights(weights_path))
+    elif ckpt_file:
         model_path = os.path.join(FLAGS.train_dir, ckpt_file)
-        if tf.gfile.Exists(model_path):
-            sys.stderr.write("Reading model parameters from %s\n" % model_path)
-            sys.stderr.flush()
-            model.saver.restore(session, model_path)
+        if not tf.gfile.Exists(model_path):
+            raise ValueError("Checkpoint %s not found." % model_path)
+        sys.stderr.write("Reading model parameters from %s\n" % model_path)
+        sys.stderr.flush()
+        model.saver.restore(session, model_path)
     else:
         ckpt = tf.train.get_checkpoint_state(FLAGS.train_dir)
         if ckpt and tf.gfile.Exists(ckpt.model_checkpoint_path):
@@ -189,6 +297,8 @@ def create_model(session,
         else:
             print("Created model with fresh parameters.")
             session.run(tf.initialize_all_variables())
+    # Checkpoints do not hold local variables such as gradient accumulators.
+    session.run(tf.initialize_local_variables())
     return model
 
 
@@ -196,8 +306,50 @@ def create_model(session,
 
 
 
-def train():
-    """Train a en->fr translation model using WMT data."""
+def evaluate(session, model, dev_set):
+    """Print the perplexity of a random dev batch of each bucket.
+
+    Returns:
+      The mean perplexity over the non-empty buckets.
+    """
+    perplexities = []
+    for bucket_id in xrange(len(_buckets)):
+        if len(dev_set[bucket_id]) == 0:
+            print("  eval: empty bucket %d" % (bucket_id))
+            continue
+        encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs, target_weights = model.get_batch(
+                dev_set, bucket_id)
+        _, eval_loss, _ = model.step(session, encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs,
+                                     target_weights, bucket_id, True)
+        eval_ppx = math.exp(eval_loss) if eval_loss < 300 else float('inf')
+        print("  eval: bucket %d perplexity %.2f" % (bucket_id, eval_ppx))  # annotated by yfeng
+        perplexities.append(eval_ppx)
+    return sum(perplexities) / max(len(perplexities), 1)
+
+
+def iterator_path(checkpoint_path):
+    """The file the training data position is saved in next to a checkpoint."""
+    return os.path.join(FLAGS.train_dir, os.path.basename(checkpoint_path) + ".iterator.json")
+
+
+def train(cluster=None, target=""):
+    """Train a en->fr translation model using WMT data.
+
+    Args:
+      cluster: optional tf.train.ClusterSpec; the model is then replicated on
+        every worker of the cluster, with the variables on the "ps" job, and
+        each replica trains on its own part of every batch.
+      target: the session target, e.g. the server of worker 0.
+
+    Raises:
+      ValueError: if steps_per_checkpoint is not a multiple of accumulate_steps.
+    """
+    # Checkpoints and the saved iterator position must fall between two
+    # updates: the accumulated gradients are not saved.
+    if FLAGS.steps_per_checkpoint % FLAGS.accumulate_steps:
+        raise ValueError("--steps_per_checkpoint (%d) must be a multiple of "
+                         "--accumulate_steps (%d)."
+                         % (FLAGS.steps_per_checkpoint, FLAGS.accumulate_steps))
     # Prepare WMT data.
     # print("Preparing WMT data in %s" % FLAGS.data_dir)  #annotated by yfeng
     print("Preparing training and dev data in %s" % FLAGS.data_dir)  # added by yfeng
@@ -215,12 +367,36 @@ def train():
     if FLAGS.fr_vocab_size > len(fr_vocab):
         FLAGS.fr_vocab_size = len(fr_vocab)
 
-    with tf.Session() as sess:
+    replica_devices = None
+    if cluster is not None:
+        replica_devices = [tf.train.replica_device_setter(
+                worker_device="/job:worker/task:%d" % task, cluster=cluster)
+                for task in xrange(cluster.num_tasks("worker"))]
+
+    with tf.Session(target, config=session_config()) as sess:
         # Create model.
         # print("Creating %d layers of %d units." % (FLAGS.num_layers, FLAGS.size)) #annotated by yfeng
         print("Creating %d layers of %d units with word embedding %d."
               % (FLAGS.num_layers, FLAGS.hidden_units, FLAGS.hidden_edim))  # added by yfeng
-        model = create_model(sess, False)
+        model = create_model(sess, False, replica_devices=replica_devices)
+        saver = model.saver
+        if FLAGS.async_checkpoint:
+            saver = checkpoint_saver.AsyncSaver(tf.all_variables(), max_to_keep=1000,
+                                                keep_checkpoint_every_n_hours=6)
+        if FLAGS.profile_every_n_steps:
+            model.profiler = profiling.Profiler(
+                    FLAGS.profile_every_n_steps,
+                    FLAGS.profile_dir or os.path.join(FLAGS.train_dir, "profile"))
+        metrics = None
+        if FLAGS.metrics_file:
+            metrics = train_metrics.ThroughputMetrics(
+                    os.path.join(FLAGS.train_dir, FLAGS.metrics_file))
+        retention = None
+        if FLAGS.keep_best or FLAGS.keep_last or FLAGS.keep_every_n_steps:
+            retention = checkpoint_saver.RetentionPolicy(
+                    FLAGS.train_dir, FLAGS.keep_best, FLAGS.keep_last,
+                    FLAGS.keep_every_n_steps, FLAGS.weights_copies,
+                    FLAGS.keep_weights_copies)
 
         # Read data into buckets and compute their sizes.
         print("Reading development and training data (limit: %d)."
@@ -228,36 +404,46 @@ def train():
         dev_set = read_data(en_dev_1, en_dev_2, fr_dev)
         train_set = read_data(en_train_1, en_train_2, fr_train, FLAGS.max_train_data_size)
         train_bucket_sizes = [len(train_set[b]) for b in xrange(len(_buckets))]
-        train_total_size = float(sum(train_bucket_sizes))
 
-        # A bucket scale is a list of increasing numbers from 0 to 1 that we'll use
-        # to select a bucket. Length of [scale[i], scale[i+1]] is proportional to
-        # the size if i-th training bucket, as used later.
-        train_buckets_scale = [sum(train_bucket_sizes[:i + 1]) / train_total_size
-                               for i in xrange(len(train_bucket_sizes))]
+        # The training data is visited epoch by epoch, in shuffled batches of
+        # the buckets; every replica gets its part of each batch. The position
+        # is saved with each checkpoint and resumed from the restored one.
+        iterator = data_iterator.EpochIterator(train_bucket_sizes,
+                                               FLAGS.batch_size * model.num_replicas)
+        ckpt = tf.train.get_checkpoint_state(FLAGS.train_dir)
+        if ckpt and iterator.restore(iterator_path(ckpt.model_checkpoint_path)):
+            print("Resuming epoch %d at batch %d of %d."
+                  % (iterator.epoch, iterator.position, iterator.batches_per_epoch))
 
         # This is the training loop.
         step_time, loss = 0.0, 0.0
         current_step = 0
         previous_losses = []
         while True:
-            # Choose a bucket according to data distribution. We pick a random number
-            # in [0, 1] and use the corresponding interval in train_buckets_scale.
-            random_number_01 = np.random.random_sample()
-            bucket_id = min([i for i in xrange(len(train_buckets_scale))
-                             if train_buckets_scale[i] > random_number_01])
-
             # Get a batch and make a step.
+            bucket_id, indices = iterator.next_batch()
             start_time = time.time()
-            encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs, target_weights = model.get_batch(
-                    train_set, bucket_id)
-
-            _, step_loss, _ = model.step(sess, encoder_inputs_1, encoder_inputs_2,
-                                         encoder_mask_1, encoder_mask_2,
-                                         decoder_inputs,
-                                         target_weights, bucket_id, False)
-
-            step_time += (time.time() - start_time) / FLAGS.steps_per_checkpoint
+            batches = [model.get_batch(train_set, bucket_id,
+                                       indices[r * FLAGS.batch_size:(r + 1) * FLAGS.batch_size])
+                       for r in xrange(model.num_replicas)]
+            batch_time = time.time()
+            if model.profiler is not None and model.profiler.next_is_traced():
+                model.profiler.add_python_time("get_batch", batch_time - start_time)
+            if model.num_replicas > 1:
+                _, step_loss = model.replicated_step(sess, batches, bucket_id)
+            else:
+                encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs, target_weights = batches[0]
+
+                _, step_loss, _ = model.step(sess, encoder_inputs_1, encoder_inputs_2,
+                                             encoder_mask_1, encoder_mask_2,
+                                             decoder_inputs,
+                                             target_weights, bucket_id, False)
+
+            end_time = time.time()
+            if metrics is not None:
+                metrics.add_step(bucket_id, batches, batch_time - start_time,
+                                 end_time - batch_time)
+            step_time += (end_time - start_time) / FLAGS.steps_per_checkpoint
             loss += step_loss / FLAGS.steps_per_checkpoint
             current_step += 1
 
@@ -273,118 +459,320 @@ def train():
                 if len(previous_losses) > 2 and loss > max(previous_losses[-3:]) and model.learning_rate.eval() > 1e-12:
                     sess.run(model.learning_rate_decay_op)
                 previous_losses.append(loss)
+                if metrics is not None:
+                    record = metrics.write(model.global_step.eval())
+                    print("  tokens/sec source %.0f target %.0f padding source %.2f target %.2f"
+                          % (record["source_tokens_per_sec"], record["target_tokens_per_sec"],
+                             record["source_padding"], record["target_padding"]))
+                if model.profiler is not None and model.profiler.num_traces:
+                    print(model.profiler.write_table())
                 # Save checkpoint and zero timer and loss.
                 checkpoint_path = os.path.join(FLAGS.train_dir, "translate.ckpt")
-                model.saver.save(sess, checkpoint_path, global_step=model.global_step)
+                if retention is not None:
+                    retention.apply(saver)
+                saved_path = saver.save(sess, checkpoint_path, global_step=model.global_step)
+                iterator.save(iterator_path(saved_path))
                 step_time, loss = 0.0, 0.0
                 # Run evals on development set and print their perplexity.
-                for bucket_id in xrange(len(_buckets)):
-                    if len(dev_set[bucket_id]) == 0:
-                        print("  eval: empty bucket %d" % (bucket_id))
-                        continue
-                    encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs, target_weights = model.get_batch(
-                            dev_set, bucket_id)
-                    _, eval_loss, _ = model.step(sess, encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs,
-                                                 target_weights, bucket_id, True)
-                    eval_ppx = math.exp(eval_loss) if eval_loss < 300 else float('inf')
-                    print("  eval: bucket %d perplexity %.2f" % (bucket_id, eval_ppx))  # annotated by yfeng
+                if FLAGS.dev_eval:
+                    checkpoint_saver.record_dev_metric(
+                            FLAGS.train_dir, saved_path, evaluate(sess, model, dev_set))
 
                 sys.stdout.flush()
 
 
+def eval_worker():
+    """Evaluate the checkpoints of a training run as they are written.
+
+    Runs next to `translate.py --dev_eval=False`, so that the trainer does not
+    pause for dev evaluation.
+    """
+    _, _, _, en_dev_1, en_dev_2, fr_dev, _, _, _ = data_utils.prepare_wmt_data(
+            FLAGS.data_dir, FLAGS.en_vocab_size_1, FLAGS.en_vocab_size_2, FLAGS.fr_vocab_size)
+    dev_set = read_data(en_dev_1, en_dev_2, fr_dev)
+    evaluated = set()
+    with tf.Session(config=session_config()) as sess:
+        model = None
+        while True:
+            ckpt = tf.train.get_checkpoint_state(FLAGS.train_dir)
+            paths = list(ckpt.all_model_checkpoint_paths) if ckpt else []
+            paths = [path for path in paths if path not in evaluated]
+            if not paths:
+                time.sleep(FLAGS.eval_interval_secs)
+                continue
+            # Only the newest checkpoint is evaluated if several are waiting.
+            path = paths[-1]
+            evaluated.update(paths)
+            # The stored paths already include train_dir.
+            if not tf.gfile.Exists(path):
+                raise ValueError("Checkpoint %s of the checkpoint state not found." % path)
+            if model is None:
+                model = create_model(sess, False, os.path.relpath(path, FLAGS.train_dir))
+            else:
+                model.saver.restore(sess, path)
+            print("eval: %s global step %d" % (path, model.global_step.eval()))
+            checkpoint_saver.record_dev_metric(FLAGS.train_dir, path,
+                                               evaluate(sess, model, dev_set))
+            sys.stdout.flush()
+
+
+def load_vocabularies():
+    """Load the decoding vocabularies, capping the vocabulary size flags."""
+    en_vocab_path_1 = os.path.join(FLAGS.data_dir,
+                                 "vocab%d.en_1" % FLAGS.en_vocab_size_1)
+    en_vocab_path_2 = os.path.join(FLAGS.data_dir,
+                                 "vocab%d.en_2" % FLAGS.en_vocab_size_2)
+    fr_vocab_path = os.path.join(FLAGS.data_dir,
+                                 "vocab%d.fr" % FLAGS.fr_vocab_size)
+    en_vocab_1, _ = data_utils.initialize_vocabulary(en_vocab_path_1)
+    en_vocab_2, _ = data_utils.initialize_vocabulary(en_vocab_path_2)
+    fr_vocab, rev_fr_vocab = data_utils.initialize_vocabulary(fr_vocab_path)
+
+    if FLAGS.en_vocab_size_1 > len(en_vocab_1):
+        FLAGS.en_vocab_size_1 = len(en_vocab_1)
+    if FLAGS.en_vocab_size_2 > len(en_vocab_2):
+        FLAGS.en_vocab_size_2 = len(en_vocab_2)
+    if FLAGS.fr_vocab_size > len(fr_vocab):
+        FLAGS.fr_vocab_size = len(fr_vocab)
+    return en_vocab_1, en_vocab_2, rev_fr_vocab
+
+
+def export():
+    """Write the decoding graph of the model as a frozen inference graph."""
+    load_vocabularies()
+    frozen_path = os.path.join(FLAGS.train_dir,
+                               FLAGS.frozen_model or FLAGS.model + ".frozen.pb")
+    with tf.Session(config=session_config()) as sess:
+        model = create_model(sess, True, FLAGS.model)
+        seq2seq_model.export_frozen_model(sess, model, frozen_path)
+    print("Wrote frozen model to %s" % frozen_path)
+
+
+def prepare_pair(sentence_1, sentence_2, en_vocab_1, en_vocab_2, buckets):
+    """Token ids of an input pair, cut to the largest bucket, and its bucket.
+
+    Returns:
+      The triple (bucket_id, token_ids_1, token_ids_2).
+    """
+    # Get token-ids for the input sentence.
+    token_ids_1 = data_utils.sentence_to_token_ids(tf.compat.as_bytes(sentence_1), en_vocab_1)
+    token_ids_2 = data_utils.sentence_to_token_ids(tf.compat.as_bytes(sentence_2), en_vocab_2)
+    if len(token_ids_1) > buckets[-1][0]: # Added by al to cut short overlength input
+        token_ids_1 = token_ids_1[:buckets[-1][0]]
+    if len(token_ids_2) > buckets[-1][1]: # Added by al to cut short overlength input
+        token_ids_2 = token_ids_2[:buckets[-1][1]]
+    # Which bucket does it belong to?
+    bucket_id = [b for b in xrange(len(buckets))
+                 if buckets[b][0] > len(token_ids_1) and buckets[b][1] > len(token_ids_2)]
+    if bucket_id:
+        bucket_id = min(bucket_id)
+    else:
+        bucket_id = len(buckets) - 1
+    return bucket_id, token_ids_1, token_ids_2
+
+
+def output_sentence(outputs, rev_fr_vocab):
+    """The French sentence of the output symbols of one sentence."""
+    # This is a greedy decoder - outputs are just argmaxes of output_logits.
+    # outputs = [int(np.argmax(logit, axis=1)) for logit in output_logits]  # annotated by shiyue
+
+    # This is a beam search decoder - output is the best result from beam search
+    outputs = [int(output) for output in outputs]  # added by shiyue
+
+    # If there is an EOS symbol in outputs, cut them at that point.
+    if data_utils.EOS_ID in outputs:
+        outputs = outputs[:outputs.index(data_utils.EOS_ID)]
+    return " ".join([tf.compat.as_str(rev_fr_vocab[output]) for output in outputs])
+
+
+def input_pairs(en_vocab_1, en_vocab_2, buckets):
+    """The prepared pairs (see prepare_pair) of the decoding input.
+
+    The input, standard input or --input_files as set by --input_format, is
+    read and tokenized --read_ahead pairs ahead in a helper thread.
+    """
+    if FLAGS.input_format == "files":
+        pairs = pair_reader.read_pairs("files", paths=FLAGS.input_files.split(","))
+    else:
+        pairs = pair_reader.read_pairs(FLAGS.input_format, sys.stdin)
+    return pair_reader.prefetch(
+            pairs, lambda pair: prepare_pair(pair[0], pair[1], en_vocab_1, en_vocab_2, buckets),
+            FLAGS.read_ahead)
+
+
+def model_id(buckets):
+    """Names the decoding model in translation cache keys.
+
+    The name is that of the model's files with their latest modification
+    time, so that a checkpoint written again under the same name does not hit
+    the translations of the old one, and the buckets, which the inputs are
+    padded to and so can change the translations.
+    """
+    path = os.path.join(FLAGS.train_dir, FLAGS.frozen_model or FLAGS.weights or FLAGS.model)
+    # The model's own data files only: not path-2500 for path-250, nor files
+    # written next to a checkpoint later (the iterator state, weights copies).
+    filenames = [path, path + ".meta", path + ".index"] + glob.glob(path + ".data-*")
+    mtimes = [os.path.getmtime(filename) for filename in filenames if os.path.exists(filename)]
+    return "%s@%d:%s" % (os.path.basename(path), max(mtimes) if mtimes else 0,
+                         bucketing.format_buckets(buckets))
+
+
 def decode():
-    with tf.Session() as sess:
+    with tf.Session(config=session_config()) as sess:
         #_buckets = [(10, 10), (20, 20), (30, 30), (40, 40), (51, 51), (100, 100)]
         # Load vocabularies.
-        en_vocab_path_1 = os.path.join(FLAGS.data_dir,
-                                     "vocab%d.en_1" % FLAGS.en_vocab_size_1)
-        en_vocab_path_2 = os.path.join(FLAGS.data_dir,
-                                     "vocab%d.en_2" % FLAGS.en_vocab_size_2)
-        fr_vocab_path = os.path.join(FLAGS.data_dir,
-                                     "vocab%d.fr" % FLAGS.fr_vocab_size)
-        en_vocab_1, rev_en_vocab_1 = data_utils.initialize_vocabulary(en_vocab_path_1)
-        en_vocab_2, rev_en_vocab_2 = data_utils.initialize_vocabulary(en_vocab_path_2)
-        fr_vocab, rev_fr_vocab = data_utils.initialize_vocabulary(fr_vocab_path)
-
-        if FLAGS.en_vocab_size_1 > len(en_vocab_1):
-            FLAGS.en_vocab_size_1 = len(en_vocab_1)
-        if FLAGS.en_vocab_size_2 > len(en_vocab_2):
-            FLAGS.en_vocab_size_2 = len(en_vocab_2)
-        if FLAGS.fr_vocab_size > len(fr_vocab):
-            FLAGS.fr_vocab_size = len(fr_vocab)
+        en_vocab_1, en_vocab_2, rev_fr_vocab = load_vocabularies()
 
         # Create model and load parameters.
-        model = create_model(sess, True, FLAGS.model)
-        model.batch_size = 1  # We decode one sentence at a time.
+        if FLAGS.frozen_model:
+            frozen_path = os.path.join(FLAGS.train_dir, FLAGS.frozen_model)
+            sys.stderr.write("Reading frozen model from %s\n" % frozen_path)
+            sys.stderr.flush()
+            model = seq2seq_model.FrozenSeq2SeqModel(sess, frozen_path)
+        else:
+            model = create_model(sess, True, FLAGS.model)
+        cache = None
+        if FLAGS.cache_entries or FLAGS.cache_bytes or FLAGS.cache_file:
+            cache = translation_cache.TranslationCache(FLAGS.cache_entries, FLAGS.cache_bytes,
+                                                       FLAGS.cache_file)
+        pairs = input_pairs(en_vocab_1, en_vocab_2, model.buckets)
+        if FLAGS.decode_batch_size > 1:
+            decode_batched(sess, model, pairs, rev_fr_vocab, cache)
+        else:
+            decode_pairs(sess, model, pairs, rev_fr_vocab, cache)
+        if cache is not None:
+            cache.save()
+            sys.stderr.write("Translation cache: %d hits, %d misses, %d entries\n"
+                             % (cache.hits, cache.misses, len(cache)))
 
-        # Decode from standard input.
-        # sys.stdout.write("> ")
-        # sys.stdout.flush()
-        sentence_1 = sys.stdin.readline()
-        sentence_2 = sys.stdin.readline()
-        while sentence_1 and sentence_2:
-            # Get token-ids for the input sentence.
-            token_ids_1 = data_utils.sentence_to_token_ids(tf.compat.as_bytes(sentence_1), en_vocab_1)
-            token_ids_2 = data_utils.sentence_to_token_ids(tf.compat.as_bytes(sentence_2), en_vocab_2)
-            if len(token_ids_1) > _buckets[-1][0]: # Added by al to cut short overlength input
-                token_ids_1 = token_ids_1[:_buckets[-1][0]]
-            if len(token_ids_2) > _buckets[-1][1]: # Added by al to cut short overlength input
-                token_ids_2 = token_ids_2[:_buckets[-1][1]]
-            # Which bucket does it belong to?
-            bucket_id = [b for b in xrange(len(_buckets))
-                         if _buckets[b][0] > len(token_ids_1) and _buckets[b][1] > len(token_ids_2)]
-            if bucket_id:
-                bucket_id = min(bucket_id)
-            else:
-                bucket_id = len(_buckets) - 1
+
+def decode_pairs(session, model, prepared_pairs, rev_fr_vocab, cache=None):
+    """Translate the prepared pairs of the input one at a time.
+
+    Translations found in cache (a TranslationCache, or None) are printed
+    without running the model; the others are added to it.
+    """
+    model.batch_size = 1  # We decode one sentence at a time.
+    model_key = model_id(model.buckets)
+
+    # Decode from standard input.
+    # sys.stdout.write("> ")
+    # sys.stdout.flush()
+    for bucket_id, token_ids_1, token_ids_2 in prepared_pairs:
+        key = translation_cache.cache_key(model_key, token_ids_1, token_ids_2, FLAGS.beam_size)
+        translation = cache.get(key) if cache is not None else None
+        if translation is None:
             # Get a 1-element batch to feed the sentence to the model.
             encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs, target_weights = model.get_batch(
                     {bucket_id: [(token_ids_1, token_ids_2, [])]}, bucket_id)
-            # Get output logits for the sentence.
-            _, _, output_logits = model.step(sess, encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs,
-                                             target_weights, bucket_id, True)
-
-            # This is a greedy decoder - outputs are just argmaxes of output_logits.
-            # outputs = [int(np.argmax(logit, axis=1)) for logit in output_logits]  # annotated by shiyue
-
-            # This is a beam search decoder - output is the best result from beam search
-            outputs = [int(logit) for logit in output_logits]  # added by shiyue
-
-            # If there is an EOS symbol in outputs, cut them at that point.
-            if data_utils.EOS_ID in outputs:
-                outputs = outputs[:outputs.index(data_utils.EOS_ID)]
-            # Print out French sentence corresponding to outputs.
-            # sys.stdout.flush()
-            print(" ".join([tf.compat.as_str(rev_fr_vocab[output]) for output in outputs]))
-            # print("> ", end="")
-            sys.stdout.flush()
-            sentence_1 = sys.stdin.readline()
-            sentence_2 = sys.stdin.readline()
+            # Get output symbols for the sentence.
+            _, _, output_symbols = model.step(session, encoder_inputs_1, encoder_inputs_2, encoder_mask_1, encoder_mask_2, decoder_inputs,
+                                              target_weights, bucket_id, True)
+            translation = output_sentence([symbols[0] for symbols in output_symbols], rev_fr_vocab)
+            if cache is not None:
+                cache.put(key, translation)
+        # Print out French sentence corresponding to outputs.
+        # sys.stdout.flush()
+        print(translation)
+        # print("> ", end="")
+        sys.stdout.flush()
+
+
+def decode_batched(session, model, prepared_pairs, rev_fr_vocab, cache=None):
+    """Translate the input in batches of pairs of similar length.
+
+    The prepared pairs of the input are taken in windows of --decode_window
+    pairs. The pairs of a window that are not in cache (a TranslationCache,
+    or None) are sorted by bucket and length and decoded --decode_batch_size
+    at a time, each distinct pair once; the translations are printed in
+    input order.
+    """
+    model_key = model_id(model.buckets)
+    while True:
+        pairs = list(itertools.islice(prepared_pairs, FLAGS.decode_window))
+        if not pairs:
+            return
+
+        translations = [None] * len(pairs)
+        # The pairs to decode, by key, with the positions they occur at.
+        pending = collections.OrderedDict()
+        for i, (_, token_ids_1, token_ids_2) in enumerate(pairs):
+            key = translation_cache.cache_key(model_key, token_ids_1, token_ids_2, FLAGS.beam_size)
+            if key in pending:
+                # A repeat of a pending pair is one miss, not one per repeat.
+                pending[key].append(i)
+                continue
+            translations[i] = cache.get(key) if cache is not None else None
+            if translations[i] is None:
+                pending.setdefault(key, []).append(i)
+
+        def bucket_of(key):
+            return pairs[pending[key][0]][0]
+        order = sorted(pending, key=lambda key: (bucket_of(key), len(key[1]), len(key[2])))
+        for bucket_id, group in itertools.groupby(order, key=bucket_of):
+            group = list(group)
+            for start in xrange(0, len(group), FLAGS.decode_batch_size):
+                batch_keys = group[start:start + FLAGS.decode_batch_size]
+                model.batch_size = len(batch_keys)
+                batch = model.get_batch(
+                        {bucket_id: [(list(key[1]), list(key[2]), []) for key in batch_keys]},
+                        bucket_id, xrange(len(batch_keys)))
+                _, _, output_symbols = model.step(session, *(list(batch) + [bucket_id, True]))
+                for row, key in enumerate(batch_keys):
+                    translation = output_sentence(
+                            [symbols[row] for symbols in output_symbols], rev_fr_vocab)
+                    if cache is not None:
+                        cache.put(key, translation)
+                    for i in pending[key]:
+                        translations[i] = translation
+        for translation in translations:
+            print(translation)
+        sys.stdout.flush()
 
 
 def self_test():
     """Test the translation model."""
-    with tf.Session() as sess:
+    with tf.Session(config=session_config()) as sess:
         print("Self-test for neural translation model.")
-        # Create model with vocabularies of 10, 2 small buckets, 2 layers of 32.
-        model = seq2seq_model.Seq2SeqModel(10, 10, [(3, 3), (6, 6)], 32, 2,
-                                           5.0, 32, 0.3, 0.99, num_samples=8)
+        # Create model with vocabularies of 10, 2 small buckets, 1 layer of 32
+        # and random constant embeddings of 16.
+        constant_emb = np.random.normal(0, 0.01, (10, 16)).astype(np.float32)
+        model = seq2seq_model.Seq2SeqModel(10, 10, 10, [(3, 3, 3), (6, 6, 6)], 16, 32, 1,
+                                           5.0, 32, 0.3, 0.99, 2,
+                                           constant_emb_en=constant_emb,
+                                           constant_emb_fr=constant_emb)
         sess.run(tf.initialize_all_variables())
+        sess.run(tf.initialize_local_variables())
 
-        # Fake data set for both the (3, 3) and (6, 6) bucket.
-        data_set = ([([1, 1], [2, 2]), ([3, 3], [4]), ([5], [6])],
-                    [([1, 1, 1, 1, 1], [2, 2, 2, 2, 2]), ([3, 3, 3], [5, 6])])
+        # Fake data set for both the (3, 3, 3) and (6, 6, 6) bucket.
+        data_set = ([([1, 1], [3, 3], [2, 2]), ([3, 3], [5], [4]), ([5], [7, 7], [6])],
+                    [([1, 1, 1, 1, 1], [3, 3, 3], [2, 2, 2, 2, 2]), ([3, 3, 3], [4, 4, 4, 4], [5, 6])])
         for _ in xrange(5):  # Train the fake model for 5 steps.
             bucket_id = random.choice([0, 1])
-            encoder_inputs, decoder_inputs, target_weights = model.get_batch(
-                    data_set, bucket_id)
-            model.step(sess, encoder_inputs, decoder_inputs, target_weights,
-                       bucket_id, False)
+            batch = model.get_batch(data_set, bucket_id)
+            _, step_loss, _ = model.step(sess, *(list(batch) + [bucket_id, False]))
+            print("  bucket %d loss %.4f" % (bucket_id, step_loss))
 
 
 def main(_):
-    if FLAGS.self_test:
+    if FLAGS.buckets:
+        _buckets[:] = bucketing.parse_buckets(FLAGS.buckets)
+    if FLAGS.worker_hosts:
+        cluster = tf.train.ClusterSpec({"ps": FLAGS.ps_hosts.split(","),
+                                        "worker": FLAGS.worker_hosts.split(",")})
+        server = tf.train.Server(cluster, job_name=FLAGS.job_name,
+                                 task_index=FLAGS.task_index)
+        if FLAGS.job_name == "ps" or FLAGS.task_index > 0:
+            # Worker 0 places the replicas on the other tasks and drives them.
+            server.join()
+        else:
+            train(cluster, server.target)
+    elif FLAGS.self_test:
         self_test()
+    elif FLAGS.export:
+        export()
+    elif FLAGS.eval_worker:
+        eval_worker()
     elif FLAGS.decode:
         decode()
     else:
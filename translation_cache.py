@@ -0,0 +1,120 @@
+# Copyright 2015 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""A least-recently-used cache of translations, optionally kept on disk.
+
+Translations are keyed by the model they come from, the token ids of the
+source and the draft, and the beam size, so a cache file can be shared by
+decoding runs of different checkpoints without mixing up their results.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import os
+import pickle as pkl
+import sys
+import tempfile
+
+# Bytes counted per token id of a key, on top of the translation's length.
+_BYTES_PER_ID = 8
+
+
+def cache_key(model_id, token_ids_1, token_ids_2, beam_size):
+    """The key of a translation in a TranslationCache."""
+    return model_id, tuple(token_ids_1), tuple(token_ids_2), beam_size
+
+
+def _entry_bytes(key, translation):
+    return len(key[0]) + _BYTES_PER_ID * (len(key[1]) + len(key[2])) + len(translation)
+
+
+class TranslationCache(object):
+    """Translations by cache_key, evicting the least recently used ones.
+
+    The size is bounded by a number of entries, by an approximate number of
+    bytes (the translation plus 8 bytes per token id of the key), or both;
+    a bound of 0 is no bound.
+    """
+
+    def __init__(self, max_entries=0, max_bytes=0, path=None):
+        """Create the cache, loading path if it exists.
+
+        A cache file that cannot be read is ignored with a warning, and the
+        cache starts empty.
+
+        Args:
+          max_entries: maximum number of translations kept.
+          max_bytes: maximum approximate size of the translations kept.
+          path: file the cache is loaded from and saved to by save().
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    entries = pkl.load(f)
+            except Exception as e:  # pylint: disable=broad-except
+                sys.stderr.write("Warning: ignoring unreadable translation cache %s: %s\n"
+                                 % (path, e))
+                entries = []
+            for key, translation in entries:
+                self.put(key, translation)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """The translation of key, or None; a hit makes it the most recent."""
+        translation = self._entries.pop(key, None)
+        if translation is None:
+            self.misses += 1
+            return None
+        self._entries[key] = translation
+        self.hits += 1
+        return translation
+
+    def put(self, key, translation):
+        """Add a translation, evicting the least recently used ones if needed."""
+        if key in self._entries:
+            self._bytes -= _entry_bytes(key, self._entries.pop(key))
+        self._entries[key] = translation
+        self._bytes += _entry_bytes(key, translation)
+        while self._entries and (
+                (self.max_entries and len(self._entries) > self.max_entries) or
+                (self.max_bytes and self._bytes > self.max_bytes)):
+            old_key, old_translation = self._entries.popitem(last=False)
+            self._bytes -= _entry_bytes(old_key, old_translation)
+
+    def save(self):
+        """Write the cache to its path, least recently used first.
+
+        The file is written under a temporary name of its own and renamed, so
+        that processes sharing the path (e.g. the workers of
+        decode_parallel.py) each replace it whole; the last one wins.
+        """
+        if not self.path:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".",
+                                         prefix=os.path.basename(self.path) + ".")
+        with os.fdopen(fd, "wb") as f:
+            pkl.dump(list(self._entries.items()), f, protocol=2)
+        os.rename(temp_path, self.path)